@@ -0,0 +1,124 @@
+"""
+Stateless HTTP endpoints next to the Streamlit app, e.g. for dashboards that
+only need the figure or the numbers of a constellation, without loading the
+page and starting a Streamlit session.
+
+Both take the same URL parameters as the app (including short URLs, s=<ID>):
+    /api/constellation.json?date=20240501&time=1200&bodies=Earth&bodies=PSP&speeds=400&speeds=350
+        coord_table (one record per body), state, and share URL
+    /api/constellation.png?...  (or .svg, .pdf, _thumbnail.png)
+        rendered figure
+
+Unlike the app, which replaces invalid parameters by defaults with a warning,
+they answer with status 400 and the messages if any parameter is invalid.
+
+They run in the same process as the app and use the same caches (positions,
+constellations, figures, exported tables). Requests are computed by a pool of
+API_WORKERS threads, so many concurrent requests don't block the server.
+
+Start the app with the endpoints with:
+    streamlit run api.py
+This also starts the warm-up of the caches (see warmup.py) at server start.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import os
+
+import streamlit as st
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import timing
+from app_state import parse_params, plain_text
+from constellation import FIGURE_FORMATS, export_table, get_constellation, render_figure
+from permalinks import resolve_permalink
+from warmup import start_warmup
+
+# number of threads computing API requests (shared by all requests)
+API_WORKERS = int(os.environ.get('SOLARMACH_API_WORKERS', 8))
+_api_executor = concurrent.futures.ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix='api')
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_app.py')
+
+
+def request_state(query_params):
+    """
+    AppState and warnings of the request's query parameters (a starlette
+    QueryParams), or (None, error) for unknown short URLs
+    """
+    params = {}
+    for key, value in query_params.multi_items():
+        params.setdefault(key, []).append(value)
+    if 's' in params:
+        permalink = resolve_permalink(params.pop('s')[0])
+        if permalink is None:
+            return None, 'Unknown short URL'
+        params = {**permalink, **params}
+    return parse_params(params)
+
+
+def _compute(state, fmt):
+    # runs in the API thread pool; logged like a script run of the app
+    timing.start_run()
+    try:
+        timing.count_cache('constellation')
+        c = get_constellation(state)
+        if fmt == 'json':
+            return export_table(state.constellation_key, 'json', c)
+        return render_figure(state.key, fmt, c, state.plot_kwargs())
+    finally:
+        timing.finish_run()
+
+
+async def _run(request, fmt):
+    state, messages = request_state(request.query_params)
+    if state is None:
+        return JSONResponse({'error': messages}, status_code=404)
+    # every message of parse_params is about an invalid or ignored parameter
+    if messages:
+        return JSONResponse({'error': 'Invalid parameters', 'messages': [plain_text(m) for m in messages]}, status_code=400)
+    if not state.bodies:
+        return JSONResponse({'error': 'No bodies/spacecraft selected'}, status_code=400)
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(_api_executor, _compute, state, fmt)
+    except ValueError as e:
+        # no ephemeris for Earth at the requested date
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except (RuntimeError, OSError) as e:
+        # JPL Horizons down or not reachable (network errors of requests are OSErrors)
+        return JSONResponse({'error': str(e) or type(e).__name__}, status_code=502)
+    if fmt != 'json':
+        return Response(result, media_type=FIGURE_FORMATS[fmt][1])
+    return Response(json.dumps({'url': state.url(),
+                                'key': state.key,
+                                'params': state.to_params(),
+                                'coord_table': json.loads(result)}),
+                    media_type='application/json')
+
+
+async def constellation_json(request):
+    return await _run(request, 'json')
+
+
+def _figure_endpoint(fmt):
+    async def endpoint(request):
+        return await _run(request, fmt)
+    return endpoint
+
+
+ROUTES = [Route('/api/constellation.json', constellation_json)]
+for _fmt, (_suffix, _mime, _options) in FIGURE_FORMATS.items():
+    ROUTES.append(Route(f'/api/constellation{_suffix}', _figure_endpoint(_fmt)))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # warm up caches at server start, not only after the first page load
+    start_warmup()
+    yield
+
+
+app = st.App(APP_SCRIPT, routes=ROUTES, lifespan=lifespan)
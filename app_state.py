@@ -0,0 +1,299 @@
+"""
+Typed state of the app, i.e. everything that defines a constellation and its
+figure, as it's given by the URL parameters.
+
+parse_params() parses, validates, and normalizes the URL parameters in one
+pass (including the legacy ones, e.g. carr_long/ston_long and plot_nr), and
+AppState.to_params() returns them in canonical form, from which the share URL
+and the keys of all caches are derived. This way, equivalent URLs (e.g. with
+the parameters in different order, legacy names, or 'PSP' instead of 'Parker
+Solar Probe') end up with the same cache entries.
+"""
+import base64
+import dataclasses
+import datetime
+import hashlib
+import json
+import re
+import urllib.parse
+
+from bodies import MAX_BODIES, canonical_body
+
+APP_URL = 'https://solar-mach.streamlit.app/?embedded=true&'
+
+DEFAULT_BODIES = ('STEREO A', 'Earth', 'BepiColombo', 'Parker Solar Probe', 'Solar Orbiter', 'JUICE')
+DEFAULT_VSW = 400
+COORD_SYS_LIST = ['Carrington', 'Stonyhurst']
+MARKERS = ['Letters', 'Numbers', 'Squares']
+# longitude range of the reference per coordinate system
+REFERENCE_LONG_RANGE = {0: (0, 360), 1: (-180, 180)}
+
+# parameters of the state, in the order in which they are put into the URL
+STATE_PARAMS = ['date', 'time', 'coord_sys', 'plot_spirals', 'plot_sun_body_line', 'plot_trans', 'plot_markers',
+                'long_offset', 'reference_long', 'reference_lat', 'reference_vsw', 'plot_reference', 'bodies', 'speeds']
+# parameters of old URLs that are translated by parse_params
+LEGACY_PARAMS = ['carr_long', 'carr_lat', 'ston_long', 'ston_lat', 'reference_sys', 'plot_nr']
+
+
+def default_date():
+    # in UTC, like the warm-up after midnight
+    return (datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=2)).strftime("%Y%m%d")
+
+
+def canonical_params(params):
+    """
+    canonical form of the URL parameters params (dict of lists), with all
+    values as str and sorted keys
+    """
+    return {key: [str(value) for value in params[key]] for key in sorted(params)}
+
+
+def canonical_hash(params):
+    """
+    url-safe base64 sha256 hash of the canonical form of params
+    """
+    digest = hashlib.sha256(json.dumps(canonical_params(params)).encode()).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+@dataclasses.dataclass(frozen=True)
+class AppState():
+    """
+    Normalized parameters of the app. Reference coordinates are only part of
+    the state if plot_reference is set.
+    """
+    date: str = dataclasses.field(default_factory=default_date)  # YYYYMMDD
+    time: str = '0000'  # HHMM
+    bodies: tuple = DEFAULT_BODIES
+    speeds: tuple = (DEFAULT_VSW,) * len(DEFAULT_BODIES)
+    coord_sys: int = 0  # index in COORD_SYS_LIST
+    plot_spirals: bool = True
+    plot_sun_body_line: bool = True
+    plot_trans: bool = False
+    plot_markers: str = 'Numbers'
+    long_offset: int = 270
+    plot_reference: bool = False
+    reference_long: int = 0
+    reference_lat: int = 0
+    reference_vsw: int = DEFAULT_VSW
+
+    @property
+    def timestamp(self):
+        # date and time as used by SolarMACH
+        return datetime.datetime.strptime(self.date + self.time, "%Y%m%d%H%M").strftime("%Y-%m-%d %H:%M:%S")
+
+    @property
+    def coord_sys_name(self):
+        return COORD_SYS_LIST[self.coord_sys]
+
+    @property
+    def reference(self):
+        """
+        (reference_long, reference_lat), or (None, None) without reference
+        """
+        if not self.plot_reference:
+            return None, None
+        return self.reference_long, self.reference_lat
+
+    def plot_kwargs(self):
+        """
+        keyword arguments of SolarMACH.plot()
+        """
+        return dict(plot_spirals=self.plot_spirals,
+                    plot_sun_body_line=self.plot_sun_body_line,
+                    reference_vsw=self.reference_vsw,
+                    transparent=self.plot_trans,
+                    markers=False if self.plot_markers == 'Squares' else self.plot_markers.lower(),
+                    long_offset=self.long_offset)
+
+    def to_params(self):
+        """
+        canonical URL parameters (dict of lists of str) of the state
+        """
+        params = {'date': [self.date],
+                  'time': [self.time],
+                  'coord_sys': [str(self.coord_sys)],
+                  'plot_spirals': [str(int(self.plot_spirals))],
+                  'plot_sun_body_line': [str(int(self.plot_sun_body_line))],
+                  'plot_trans': [str(int(self.plot_trans))],
+                  'plot_markers': [self.plot_markers],
+                  'long_offset': [str(self.long_offset)]}
+        if self.plot_reference:
+            params['reference_long'] = [str(self.reference_long)]
+            params['reference_lat'] = [str(self.reference_lat)]
+            params['reference_vsw'] = [str(self.reference_vsw)]
+            params['plot_reference'] = ['1']
+        params['bodies'] = list(self.bodies)
+        params['speeds'] = [str(v) for v in self.speeds]
+        return params
+
+    @property
+    def key(self):
+        """
+        hash of the full state; key of the figure caches and ID of short URLs
+        """
+        return canonical_hash(self.to_params())
+
+    @property
+    def constellation_key(self):
+        """
+        hash of the parameters that define the constellation (and its
+        coordinate table), i.e. the state without the plot options
+        """
+        params = self.to_params()
+        return canonical_hash({p: params[p] for p in ['date', 'time', 'coord_sys', 'reference_long', 'reference_lat', 'bodies', 'speeds'] if p in params})
+
+    def url(self, base=APP_URL):
+        """
+        share URL of the state
+        """
+        return base + urllib.parse.urlencode(self.to_params(), doseq=True)
+
+
+class _Parser():
+    # reads single parameters, replacing invalid values by defaults with a warning
+
+    def __init__(self, params):
+        self.params = {key: list(value) if isinstance(value, (list, tuple)) else [value] for key, value in params.items()}
+        self.messages = []
+
+    def has(self, key):
+        return len(self.params.get(key, [])) > 0
+
+    def text(self, key, default):
+        return str(self.params[key][0]).strip() if self.has(key) else default
+
+    def number(self, key, default, min_value=None, max_value=None):
+        if not self.has(key):
+            return default
+        try:
+            value = int(float(self.params[key][0]))
+        except (ValueError, OverflowError):
+            self.messages.append(f"⚠️ Invalid value '{self.params[key][0]}' of URL parameter '{key}' has been replaced by {default}.")
+            return default
+        if (min_value is not None and value < min_value) or (max_value is not None and value > max_value):
+            self.messages.append(f"⚠️ Out-of-range value {value} of URL parameter '{key}' has been replaced by {default}.")
+            return default
+        return value
+
+    def flag(self, key, default):
+        return self.number(key, int(default)) != 0
+
+    def date_time(self, key, fmt, default):
+        value = self.text(key, default)
+        if fmt == "%H%M":
+            # e.g. time=30 for 00:30
+            value = value.zfill(4)
+        try:
+            datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            self.messages.append(f"⚠️ Invalid value '{value}' of URL parameter '{key}' has been replaced by {default}.")
+            return default
+        return value
+
+
+def _translate_legacy(params):
+    # replace reference coordinates of URLs before June 2023 by current ones
+    if not (params.has('plot_reference') and params.text('plot_reference', '0') == '1'):
+        return
+    p = params.params
+    for sys_index, prefix in enumerate(['carr', 'ston']):
+        if params.has(f'{prefix}_long') and params.has(f'{prefix}_lat') and params.text('reference_sys', '') == str(sys_index) and not params.has('coord_sys'):
+            p['reference_long'] = p.pop(f'{prefix}_long')
+            p['reference_lat'] = p.pop(f'{prefix}_lat')
+            p['coord_sys'] = p.pop('reference_sys')
+            return
+    if any(params.has(key) for key in ['carr_long', 'carr_lat', 'ston_long', 'ston_lat', 'reference_sys']):
+        params.messages.append('⚠️ **WARNING:** Deprecated parameters have been prodived by the URL. To avoid unexpected behaviour, plotting of the reference has been deactivated!')
+        p['plot_reference'] = ['0']
+
+
+def parse_params(params):
+    """
+    Parse, validate, and normalize URL parameters params (dict of lists, or
+    of single values) in one pass. Missing parameters get the defaults of the
+    app, invalid ones are replaced by them.
+
+    Returns
+    -------
+    state: AppState
+    messages: list
+        warnings about ignored or replaced parameters, to be shown to the user
+    """
+    p = _Parser(params)
+    _translate_legacy(p)
+
+    coord_sys = p.text('coord_sys', '0')
+    if coord_sys in COORD_SYS_LIST:
+        coord_sys = COORD_SYS_LIST.index(coord_sys)
+    else:
+        coord_sys = p.number('coord_sys', 0, 0, len(COORD_SYS_LIST) - 1)
+
+    markers = p.text('plot_markers', '').capitalize()
+    if markers not in MARKERS:
+        if markers:
+            p.messages.append(f"⚠️ Invalid value '{markers}' of URL parameter 'plot_markers' has been ignored.")
+        # plot_nr of old URLs: numbered markers or squares
+        markers = 'Squares' if p.has('plot_nr') and not p.flag('plot_nr', True) else 'Numbers'
+
+    plot_reference = p.flag('plot_reference', False)
+    reference_long, reference_lat = 0, 0
+    if plot_reference:
+        long_min, long_max = REFERENCE_LONG_RANGE[coord_sys]
+        reference_long = p.number('reference_long', 0)
+        if reference_long < long_min or reference_long > long_max:
+            p.messages.append(f'⚠️ **ERROR:** For {COORD_SYS_LIST[coord_sys]} coordinates, longitude must be between {long_min} and {long_max} degrees! Setting to 0.')
+            reference_long = 0
+        reference_lat = p.number('reference_lat', 0, -90, 90)
+
+    # map bodies to the names used in the app, e.g. 'PSP' => 'Parker Solar Probe'
+    speeds = {}
+    unknown_bodies = []
+    raw_speeds = p.params.get('speeds', [])
+    for i, raw_body in enumerate(p.params['bodies'] if p.has('bodies') else DEFAULT_BODIES):
+        body = canonical_body(raw_body)
+        if body is None:
+            unknown_bodies.append(str(raw_body))
+            continue
+        try:
+            speeds.setdefault(body, max(int(float(raw_speeds[i])), 0))
+        except IndexError:
+            speeds.setdefault(body, DEFAULT_VSW)
+        except (ValueError, OverflowError):
+            p.messages.append(f"⚠️ Invalid solar wind speed '{raw_speeds[i]}' of {body} has been replaced by {DEFAULT_VSW}.")
+            speeds.setdefault(body, DEFAULT_VSW)
+    if unknown_bodies:
+        p.messages.append(f"⚠️ Unknown bodies/spacecraft have been ignored: {', '.join(unknown_bodies)}")
+    if len(speeds) > MAX_BODIES:
+        p.messages.append(f"⚠️ Only up to {MAX_BODIES} bodies/spacecraft can be selected, the others have been ignored: {', '.join(list(speeds)[MAX_BODIES:])}")
+        speeds = dict(list(speeds.items())[:MAX_BODIES])
+
+    state = AppState(date=p.date_time('date', "%Y%m%d", default_date()),
+                     time=p.date_time('time', "%H%M", '0000'),
+                     bodies=tuple(speeds),
+                     speeds=tuple(speeds.values()),
+                     coord_sys=coord_sys,
+                     plot_spirals=p.flag('plot_spirals', True),
+                     plot_sun_body_line=p.flag('plot_sun_body_line', True),
+                     plot_trans=p.flag('plot_trans', False),
+                     plot_markers=markers,
+                     long_offset=p.number('long_offset', 270, 0, 360),
+                     plot_reference=plot_reference,
+                     reference_long=reference_long,
+                     reference_lat=reference_lat,
+                     reference_vsw=p.number('reference_vsw', DEFAULT_VSW, 0) if plot_reference else DEFAULT_VSW)
+    return state, p.messages
+
+
+def has_state_params(params):
+    """
+    True if params (dict of lists) contain any parameter of the state
+    """
+    return any(key in params for key in STATE_PARAMS + LEGACY_PARAMS)
+
+
+def plain_text(message):
+    """
+    message of parse_params() without the markdown and emoji shown in the app
+    """
+    return re.sub(r'\*\*[A-Z]+:\*\*\s*', '', message.replace('⚠️', '')).replace('**', '').strip()
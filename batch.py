@@ -0,0 +1,172 @@
+"""
+Headless batch processing of many Solar-MACH constellations.
+
+Reads a csv or jsonl file of events that use the same parameters as the URL
+of the Streamlit app (date=YYYYMMDD, time=HHMM, bodies, speeds, coord_sys,
+plot_reference=1 with reference_long and reference_lat, also the legacy ones;
+optionally an "id" per event) and writes the coordinate tables of all events
+into one parquet, feather, or csv file, with the column names shown in the
+app. In csv files, multiple bodies and speeds are separated by ";" or ",".
+Events are parsed like URLs of the app, i.e. invalid values are replaced by
+defaults (with a warning), but a missing or invalid date fails the event.
+
+Example:
+    python batch.py events.csv -o tables.parquet -j 8
+    python batch.py events.csv -o tables.parquet -j 8 --resume  # continue crashed run
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+from app_state import parse_params, plain_text
+from constellation import rename_table
+from ephemeris import build_constellation
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, float) and value != value) or str(value).strip() == ''
+
+
+def _as_list(value):
+    if _is_empty(value):
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [v.strip() for v in str(value).replace(';', ',').split(',') if v.strip()]
+
+
+def event_params(event):
+    """
+    URL parameters (dict of lists) of one event, without its id and empty
+    values
+    """
+    params = {}
+    for key, value in event.items():
+        if key == 'id' or _is_empty(value):
+            continue
+        params[key] = _as_list(value) if key in ['bodies', 'speeds'] else [str(value).strip()]
+    return params
+
+
+def parse_event(event):
+    """
+    Parse one event given with URL parameters like the app does (see
+    app_state.parse_params). Returns (AppState, messages); invalid values are
+    replaced by defaults, except for the date, which raises ValueError if
+    it's missing or invalid.
+    """
+    params = event_params(event)
+    if 'date' not in params:
+        raise ValueError('No date given')
+    state, messages = parse_params(params)
+    if state.date != params['date'][0]:
+        raise ValueError(f"Invalid date '{params['date'][0]}'")
+    return state, messages
+
+
+def compute_event(event_id, event):
+    """
+    coordinate table of one event, with the column names shown in the app
+    """
+    state, messages = parse_event(event)
+    for message in messages:
+        print(f'Event {event_id}: {plain_text(message)}', file=sys.stderr)
+    c = build_constellation(state.timestamp, state.bodies, state.speeds, *state.reference, state.coord_sys_name, silent=True)
+    df = rename_table(c.coord_table, state.coord_sys_name).reset_index()
+    df = df.rename(columns={'Spacecraft/Body': 'Spacecraft / body'})
+    df.insert(0, 'Event', str(event_id))
+    df.insert(1, 'Date', state.timestamp)
+    return df
+
+
+def read_events(infile):
+    """
+    read events from csv or jsonl file; returns list of (event_id, event dict)
+    """
+    if infile.endswith('.jsonl') or infile.endswith('.json'):
+        with open(infile) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        # read everything as str to keep leading zeros of time
+        events = pd.read_csv(infile, dtype=str, keep_default_na=False).to_dict('records')
+    return [(event.get('id') or i, event) for i, event in enumerate(events)]
+
+
+def write_table(df, outfile):
+    if outfile.endswith('.parquet'):
+        df.to_parquet(outfile, index=False)
+    elif outfile.endswith('.feather'):
+        df.to_feather(outfile)
+    else:
+        df.to_csv(outfile, index=False)
+
+
+def run(infile, outfile, workers=None, resume=False):
+    """
+    Compute all events of infile in a process pool and write them to outfile.
+    The table of every finished event is kept in outfile + '.parts' until all
+    events are done, so that a crashed run can be continued with resume=True.
+
+    Returns
+    -------
+    int
+        number of failed events
+    """
+    events = read_events(infile)
+    parts_dir = outfile + '.parts'
+    if not resume:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir, exist_ok=True)
+
+    def part_file(i):
+        return os.path.join(parts_dir, f'{i:07d}.pkl')
+
+    todo = [i for i in range(len(events)) if not os.path.exists(part_file(i))]
+    print(f'{len(events)} events, {len(events) - len(todo)} already done, computing {len(todo)}')
+
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(compute_event, *events[i]): i for i in todo}
+        for n, future in enumerate(concurrent.futures.as_completed(futures)):
+            i = futures[future]
+            try:
+                df = future.result()
+            except Exception as e:
+                failed += 1
+                print(f'!!! Event {events[i][0]} failed: {e!r}', file=sys.stderr)
+                continue
+            # write to temporary file first so that a crash doesn't leave incomplete parts
+            df.to_pickle(part_file(i) + '.tmp')
+            os.replace(part_file(i) + '.tmp', part_file(i))
+            print(f'[{n+1}/{len(todo)}] event {events[i][0]} done')
+
+    parts = [pd.read_pickle(part_file(i)) for i in range(len(events)) if os.path.exists(part_file(i))]
+    if parts:
+        write_table(pd.concat(parts, ignore_index=True), outfile)
+    if failed == 0:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    else:
+        print(f'{failed} events failed; run again with --resume to retry only those.', file=sys.stderr)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute Solar-MACH coordinate tables for many events.')
+    parser.add_argument('infile', help='csv or jsonl file of events with Solar-MACH URL parameters')
+    parser.add_argument('-o', '--outfile', required=True, help='output file (.parquet, .feather, or .csv)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--resume', action='store_true', help='continue a previous run, skipping finished events')
+    args = parser.parse_args(argv)
+    # don't warn about Streamlit caches being used outside of Streamlit
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    return 1 if run(args.infile, args.outfile, args.workers, args.resume) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
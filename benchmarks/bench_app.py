@@ -0,0 +1,233 @@
+"""
+Benchmarks of the Solar-MACH app's request pipeline.
+
+Drives streamlit_app.py headlessly with Streamlit's AppTest for increasing
+numbers of bodies (up to all bodies of solarmach.print_body_list()) and
+measures page loads with cold and warm caches and obtaining the measured
+solar wind speeds. Besides the total duration of each script run, the stages
+recorded by timing.py are reported (URL parsing, SolarMACH construction,
+plot, savefig/png export, table formatting, ...).
+
+JPL Horizons and solarmach.get_sw_speed are replaced by local stand-ins (with
+optional artificial latency), so that the results only depend on the app and
+its dependencies, and can be compared between runs, e.g. before and after
+updating requirements.txt. Results are written as JSON.
+
+Example:
+    python benchmarks/bench_app.py --bodies 1 5 20 all --repeat 3 -o bench_output.txt
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# isolate the benchmark from the caches, snapshot store, and warm-up of the
+# local installation; has to be done before the app's modules are imported
+_TMP_DIR = tempfile.mkdtemp(prefix='solarmach_bench_')
+os.environ['SOLARMACH_CACHE_DIR'] = _TMP_DIR
+os.environ['SOLARMACH_SNAPSHOT_DIR'] = os.path.join(_TMP_DIR, 'no_snapshot')
+os.environ['SOLARMACH_WARMUP_INTERVAL'] = '0'
+os.environ['SOLARMACH_MAX_BODIES'] = '1000'
+
+import astropy.units as u  # noqa: E402
+import matplotlib  # noqa: E402
+import numpy as np  # noqa: E402
+import solarmach  # noqa: E402
+import streamlit as st  # noqa: E402
+import streamlit.logger  # noqa: E402
+import sunpy  # noqa: E402
+from astropy.coordinates import SkyCoord  # noqa: E402
+from astropy.time import Time  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from sunpy.coordinates import frames  # noqa: E402
+
+import ephemeris  # noqa: E402
+import snapshot  # noqa: E402
+import timing  # noqa: E402
+from bodies import get_body_catalogue  # noqa: E402
+from sw_speed import VSW_CACHE  # noqa: E402
+
+APP_FILE = os.path.join(APP_DIR, 'streamlit_app.py')
+TRY_BUTTON = 'Try to obtain measurements'
+
+
+class StandIns():
+    """
+    Local replacements of JPL Horizons and solarmach.get_sw_speed, returning
+    deterministic values per body after latency seconds
+    """
+
+    def __init__(self, horizons_latency=0.0, sw_latency=0.0):
+        self.horizons_latency = horizons_latency
+        self.sw_latency = sw_latency
+
+    def get_horizons_coord(self, body, obstime='now', id_type=None, **kwargs):
+        obstime = Time(obstime)
+        if self.horizons_latency:
+            time.sleep(self.horizons_latency)
+        seed = zlib.crc32(str(body).encode())
+        if str(body) == '399':
+            lon = np.zeros(obstime.shape)
+            lat = 7 * np.sin((obstime.jd - 2451545) / 365.25 * 2 * np.pi)
+            dist = np.ones(obstime.shape)
+        else:
+            lon = (seed % 360 + (obstime.jd - 2451545) * (seed % 7 - 3) * 0.3) % 360 - 180
+            lat = np.zeros(obstime.shape) + (seed % 13 - 6)
+            dist = np.zeros(obstime.shape) + 0.3 + (seed % 120) / 100
+        return SkyCoord(lon * u.deg, lat * u.deg, dist * u.AU, frame=frames.HeliographicStonyhurst, obstime=obstime)
+
+    def get_sw_speed(self, body, dtime, trange=1, default_vsw=400.0, silent=False):
+        if self.sw_latency:
+            time.sleep(self.sw_latency)
+        seed = zlib.crc32(str(body).encode())
+        # no measurements for every third body
+        return default_vsw if seed % 3 == 0 else 300.0 + seed % 400
+
+    def install(self):
+        solarmach.get_horizons_coord = self.get_horizons_coord
+        solarmach.get_sw_speed = self.get_sw_speed
+        ephemeris.get_horizons_coord = self.get_horizons_coord
+        snapshot.get_horizons_coord = self.get_horizons_coord
+
+
+class RunLog(logging.Handler):
+    """
+    collects the timings that timing.py logs at the end of each script run
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.runs = []
+
+    def emit(self, record):
+        data = json.loads(record.getMessage())
+        if data.get('event') == 'run':
+            self.runs.append(data)
+
+
+def quiet_streamlit():
+    # hide the warnings of Streamlit running without server; AppTest resets
+    # the log level with every run
+    streamlit.logger.set_log_level('error')
+
+
+def clear_caches():
+    quiet_streamlit()
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    VSW_CACHE.clear()
+
+
+def app_test(bodies):
+    quiet_streamlit()
+    at = AppTest.from_file(APP_FILE, default_timeout=600)
+    at.query_params['date'] = ['20240501']
+    at.query_params['time'] = ['1200']
+    at.query_params['bodies'] = list(bodies)
+    at.query_params['speeds'] = ['400'] * len(bodies)
+    at.query_params['plot_reference'] = ['1']
+    at.query_params['reference_long'] = ['90']
+    at.query_params['reference_lat'] = ['0']
+    return at
+
+
+def measure(run_log, action):
+    """
+    duration of action and the timings of the script run(s) it triggered
+    """
+    n = len(run_log.runs)
+    start = time.perf_counter()
+    at = action()
+    total = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f'App raised an exception: {at.exception[0].value}')
+    runs = run_log.runs[n:]
+    return {'total': total, 'stages': runs[-1]['stages'] if runs else {}, 'caches': runs[-1]['caches'] if runs else {}}
+
+
+def obtain_speeds(at):
+    # the lookups run in the background; run the app again until they are applied
+    button = [b for b in at.button if b.label.startswith(TRY_BUTTON)][0]
+    button.click().run()
+    while "vsw_fetch" in at.session_state:
+        time.sleep(0.05)
+        at.run()
+    return at
+
+
+def benchmark(bodies, run_log):
+    """
+    results of all scenarios for one list of bodies
+    """
+    results = {}
+    clear_caches()
+    results['page load (cold caches)'] = measure(run_log, lambda: app_test(bodies).run())
+    results['page load (warm caches)'] = measure(run_log, lambda: app_test(bodies).run())
+    clear_caches()
+    at = app_test(bodies).run()
+    results['obtain solar wind speeds (cold caches)'] = measure(run_log, lambda: obtain_speeds(at))
+    return results
+
+
+def summarize(samples):
+    """
+    median of total and stage durations over repetitions
+    """
+    stages = sorted({stage for sample in samples for stage in sample['stages']})
+    return {'total': round(statistics.median(s['total'] for s in samples), 4),
+            'stages': {stage: round(statistics.median(s['stages'].get(stage, 0) for s in samples), 4) for stage in stages},
+            'caches': samples[-1]['caches']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Solar-MACH app with local stand-ins for network services.')
+    parser.add_argument('--bodies', nargs='+', default=['1', '5', '10', '20', 'all'], help='numbers of bodies to benchmark ("all" for all bodies)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of repetitions; the median is reported')
+    parser.add_argument('--horizons-latency', type=float, default=0.0, help='artificial latency of each JPL Horizons query in s')
+    parser.add_argument('--sw-latency', type=float, default=0.0, help='artificial latency of each solar wind speed lookup in s')
+    parser.add_argument('-o', '--outfile', default=os.path.join(APP_DIR, 'bench_output.txt'), help='output file (JSON)')
+    args = parser.parse_args(argv)
+
+    # only show the results, not the logs of the app
+    quiet_streamlit()
+    for handler in timing.logger.handlers:
+        handler.setLevel(logging.WARNING)
+    run_log = RunLog()
+    timing.logger.addHandler(run_log)
+    timing.logger.setLevel(logging.INFO)
+    StandIns(args.horizons_latency, args.sw_latency).install()
+
+    # all bodies of solarmach.print_body_list(), as named in the app
+    all_bodies = list(get_body_catalogue()[0])
+    counts = [len(all_bodies) if n == 'all' else min(int(n), len(all_bodies)) for n in args.bodies]
+    output = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'versions': {'python': platform.python_version(), 'solarmach': solarmach.__version__, 'sunpy': sunpy.__version__,
+                           'streamlit': st.__version__, 'matplotlib': matplotlib.__version__, 'numpy': np.__version__},
+              'settings': vars(args),
+              'results': []}
+    for n in counts:
+        bodies = all_bodies[:n]
+        samples = [benchmark(bodies, run_log) for _ in range(args.repeat)]
+        for scenario in samples[0]:
+            result = summarize([sample[scenario] for sample in samples])
+            output['results'].append({'bodies': n, 'scenario': scenario, **result})
+            print(f"{n:3d} bodies  {scenario:40s} {result['total']:8.3f} s   " +
+                  ', '.join(f'{stage}: {t:.3f}' for stage, t in result['stages'].items() if not stage.startswith('sw_speed ')))
+
+    with open(args.outfile, 'w') as f:
+        json.dump(output, f, indent=1)
+    print(f'Results written to {args.outfile}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Regression check of the app's constellations against solarmach.
+
+The app doesn't initialize SolarMACH objects itself, but builds them from
+positions that are cached per body (ephemeris.make_constellation) and
+calculates their coord_table on its own (ephemeris.coord_table). This checks
+that the result still equals SolarMACH(...) of the installed solarmach
+version, for both coordinate systems, with and without reference, so run it
+before raising the upper bound of solarmach in requirements.txt.
+
+JPL Horizons is replaced by the local stand-in of bench_app.py. Exits with
+status 1 if any constellation differs.
+
+Example:
+    python benchmarks/check_constellation.py
+"""
+import sys
+
+import bench_app  # sets up the isolated environment, has to come first
+import pandas as pd  # noqa: E402
+import solarmach  # noqa: E402
+
+from app_state import AppState  # noqa: E402
+from constellation import get_constellation  # noqa: E402
+
+DATES = [('20240501', '1200'), ('20210213', '0030')]
+BODIES = ('Earth', 'STEREO A', 'BepiColombo', 'Parker Solar Probe', 'Solar Orbiter', 'Mars', 'JUICE')
+SPEEDS = (400, 350, 420, 300, 580, 410, 390)
+# (coord_sys, reference_long, reference_lat) with plot_reference
+REFERENCES = [(0, None, None), (0, 200, 5), (1, None, None), (1, -40, -10)]
+
+
+def compare(state):
+    """
+    list of differences between the constellation of state in the app and
+    SolarMACH(...)
+    """
+    c_app = get_constellation(state)
+    c_ref = solarmach.SolarMACH(state.timestamp, list(state.bodies), list(state.speeds), *state.reference,
+                                coord_sys=state.coord_sys_name, silent=True)
+    differences = []
+    try:
+        pd.testing.assert_frame_equal(c_app.coord_table.reset_index(drop=True), c_ref.coord_table.reset_index(drop=True),
+                                      check_dtype=False, check_exact=False, rtol=1e-6, atol=1e-6)
+    except AssertionError as e:
+        differences.append(f'coord_table: {e}')
+    for attr in ['max_dist', 'max_dist_lat']:
+        if abs(getattr(c_app, attr) - getattr(c_ref, attr)) > 1e-6:
+            differences.append(f'{attr}: {getattr(c_app, attr)} != {getattr(c_ref, attr)}')
+    for body, entry in c_ref.body_dict.items():
+        if c_app.body_dict.get(body, [None] * 3)[:3] != entry[:3]:
+            differences.append(f'body_dict[{body!r}]: {c_app.body_dict.get(body, [None])[:3]} != {entry[:3]}')
+    return differences
+
+
+def main():
+    bench_app.quiet_streamlit()
+    bench_app.StandIns().install()
+    failed = 0
+    for date, time in DATES:
+        for coord_sys, reference_long, reference_lat in REFERENCES:
+            state = AppState(date=date, time=time, bodies=BODIES, speeds=SPEEDS, coord_sys=coord_sys,
+                             plot_reference=reference_long is not None,
+                             reference_long=reference_long or 0, reference_lat=reference_lat or 0)
+            differences = compare(state)
+            name = f'{state.timestamp} {state.coord_sys_name:10} reference={state.reference}'
+            print(f'{name}  {"differs" if differences else "ok"}')
+            for difference in differences:
+                print('    ' + difference.replace('\n', '\n    '))
+            failed += bool(differences)
+    print(f'solarmach {solarmach.__version__}: {failed} of {len(DATES) * len(REFERENCES)} constellations differ')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import os
+import types
+
+import streamlit as st
+from solarmach import body_dict, print_body_list
+
+# maximum number of bodies that can be selected in one session
+MAX_BODIES = int(os.environ.get('SOLARMACH_MAX_BODIES', 20))
+
+
+def _display_name(name):
+    # rename Lx points, e.g. 'SEMB-L1' => 'L1'
+    for l in ['1', '2', '4', '5']:
+        name = name.replace(f'SEMB-L{l}', f'L{l}')
+    return name
+
+
+@st.cache_resource(show_spinner=False)
+def get_body_catalogue():
+    """
+    Build the catalogue of bodies offered in the app once per process.
+
+    Returns
+    -------
+    names: tuple
+        body names, ordered like the (alphabetically sorted) keys of
+        solarmach.print_body_list()
+    lookup: mappingproxy
+        read-only mapping of all keys known to solarmach (e.g. 'PSP', 'psp',
+        '-96', 'Parker Solar Probe') to the corresponding name in names
+    """
+    all_bodies = print_body_list()
+    all_bodies = all_bodies.replace({name: _display_name(name) for name in all_bodies['Body']})
+    all_bodies = all_bodies.sort_index()
+    names = tuple(all_bodies['Body'])
+
+    lookup = {}
+    for key, value in body_dict.items():
+        lookup[str(key)] = _display_name(value[1])
+        lookup.setdefault(str(key).lower(), _display_name(value[1]))
+    for name in names:
+        lookup[name] = name
+        lookup[name.lower()] = name
+    return names, types.MappingProxyType(lookup)
+
+
+def canonical_body(body):
+    """
+    return name of body as used in the app, or None if it's unknown
+    """
+    lookup = get_body_catalogue()[1]
+    body = str(body)
+    return lookup.get(body, lookup.get(body.lower()))
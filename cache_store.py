@@ -0,0 +1,97 @@
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+import timing
+
+# directory for caches that should survive restarts of the app
+CACHE_DIR = os.environ.get('SOLARMACH_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'Solar-MACH'))
+
+
+class SQLiteCache():
+    """
+    Key-value store in a SQLite file that is shared between all sessions and
+    processes using the same file. Every entry has its own time-to-live; if
+    there are more than max_entries entries, the least recently used ones are
+    dropped. Values must be JSON serializable.
+
+    Parameters
+    ----------
+    filename: str
+        name of the database file inside CACHE_DIR (or absolute path)
+    max_entries: int, optional
+        maximum number of entries kept in the cache
+    name: str, optional
+        name used for cache statistics, by default filename without extension
+    """
+
+    def __init__(self, filename, max_entries=10000, name=None):
+        self.path = os.path.join(CACHE_DIR, filename)
+        self.name = name or os.path.splitext(os.path.basename(filename))[0]
+        self.max_entries = max_entries
+        self._initialized = False
+
+    @contextlib.contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                con.execute('PRAGMA journal_mode=WAL')
+                con.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)')
+                con.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+                self._initialized = True
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def get(self, key, default=None, refresh_ttl=None):
+        """
+        return value stored for key, or default if there is no valid entry;
+        with refresh_ttl (seconds), the entry then expires refresh_ttl after
+        this access instead of after it has been set
+        """
+        now = time.time()
+        timing.count_cache(self.name)
+        try:
+            with self._connect() as con:
+                row = con.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+                if row is not None and row[1] < now:
+                    con.execute('DELETE FROM cache WHERE key = ?', (key,))
+                    row = None
+                if row is not None and refresh_ttl is not None:
+                    con.execute('UPDATE cache SET accessed = ?, expires = ? WHERE key = ?', (now, now + refresh_ttl, key))
+                elif row is not None:
+                    con.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        except (OSError, sqlite3.Error):
+            # a broken cache must never break the app
+            row = None
+        if row is None:
+            timing.count_cache(self.name, miss=True)
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        """
+        store value for key for ttl seconds, then drop expired and least
+        recently used entries
+        """
+        now = time.time()
+        try:
+            with self._connect() as con:
+                con.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (key, json.dumps(value), now + ttl, now))
+                con.execute('DELETE FROM cache WHERE expires < ?', (now,))
+                con.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+        except (OSError, sqlite3.Error):
+            pass
+
+    def clear(self):
+        try:
+            with self._connect() as con:
+                con.execute('DELETE FROM cache')
+        except (OSError, sqlite3.Error):
+            pass
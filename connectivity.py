@@ -0,0 +1,119 @@
+import astropy.units as u
+import numpy as np
+import pandas as pd
+import streamlit as st
+from astropy.time import Time, TimeDelta
+
+from ephemeris import footpoint_longitude, get_positions
+from timeseries import CHUNK_SIZE, time_steps
+
+# default time steps (in hours) of the coarse scan and the refinement
+COARSE_STEP = 6
+FINE_STEP = 0.25
+# maximum number of coarse time steps of a search
+MAX_STEPS = 5000
+
+
+def _positions(body, times, coord_sys):
+    # lon, lat (deg), and distance (AU) of body for all times, obtained in chunks
+    lon, lat, dist = [], [], []
+    for i in range(0, len(times), CHUNK_SIZE):
+        pos = get_positions(body, times[i:i+CHUNK_SIZE], coord_sys)
+        lon.append(pos.lon.value)
+        lat.append(pos.lat.value)
+        dist.append(pos.radius.to_value(u.AU))
+    return np.concatenate(lon), np.concatenate(lat), np.concatenate(dist)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def coarse_positions(body, start, end, step, coord_sys):
+    """
+    positions of body on the coarse time grid, cached so that changing the
+    reference or the maximum separation doesn't query them again
+    """
+    return _positions(body, time_steps(start, end, step), coord_sys)
+
+
+def footpoint_separation(lon, lat, dist, vsw, reference_long):
+    """
+    longitudinal separation (deg, -180 to 180) between magnetic footpoints
+    and reference_long
+    """
+    footp_long, alpha = footpoint_longitude(lon, lat, dist, vsw)
+    return (footp_long - reference_long + 180) % 360 - 180
+
+
+def _windows(times, sep, connected):
+    # (start, end, closest separation, time of closest separation) of all runs of connected times
+    windows = []
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], connected.astype(int), [0]])))
+    for i, j in zip(edges[::2], edges[1::2]):
+        k = i + np.argmin(np.abs(sep[i:j]))
+        windows.append((times[i], times[j-1], sep[k], times[k]))
+    return windows
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def find_connection_windows(start, end, body_list, vsw_list, reference_long, max_sep, coord_sys='Carrington',
+                            coarse_step=COARSE_STEP, fine_step=FINE_STEP):
+    """
+    Find the time windows between start and end in which the magnetic
+    footpoint of each body is within max_sep degrees of reference_long.
+
+    The separation is first obtained every coarse_step hours. Only coarse
+    intervals that can contain connected times (i.e., the separation at one
+    of its ends is within max_sep plus the change over the interval) are
+    then scanned every fine_step hours, with one query per body for all of
+    them.
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per connection window
+    """
+    coarse_times = time_steps(start, end, coarse_step)
+    if len(coarse_times) > MAX_STEPS:
+        raise ValueError(f'Too many time steps ({len(coarse_times)}), the maximum is {MAX_STEPS}. Increase the step or reduce the time range.')
+    rows = []
+    for body, vsw in zip(body_list, vsw_list):
+        try:
+            lon, lat, dist = coarse_positions(body, start, end, coarse_step, coord_sys)
+        except (ValueError, RuntimeError):
+            print('!!! No ephemeris for target "' + str(body) + '" between ' + str(start) + ' and ' + str(end))
+            continue
+        sep = footpoint_separation(lon, lat, dist, vsw, reference_long)
+        if len(sep) < 2:
+            candidates = np.flatnonzero(np.abs(sep) <= max_sep)
+        else:
+            change = np.abs((np.diff(sep) + 180) % 360 - 180)
+            candidates = np.flatnonzero(np.minimum(np.abs(sep[:-1]), np.abs(sep[1:])) <= max_sep + change)
+        if len(candidates) == 0:
+            continue
+
+        # fine time grid over all candidate intervals; consecutive intervals
+        # form one segment, so that windows spanning several of them are found
+        segments = np.split(candidates, np.flatnonzero(np.diff(candidates) > 1) + 1)
+        fine_times = []
+        for segment in segments:
+            seg_start, seg_end = coarse_times[segment[0]], coarse_times[min(segment[-1] + 1, len(coarse_times) - 1)]
+            n = int(np.round((seg_end - seg_start).to_value('hr') / fine_step)) + 1
+            fine_times.append(seg_start + TimeDelta(np.arange(n) * fine_step * 3600, format='sec'))
+        seg_lengths = [len(t) for t in fine_times]
+        fine_times = np.concatenate(fine_times)
+        lon, lat, dist = _positions(body, fine_times, coord_sys)
+        fine_sep = footpoint_separation(lon, lat, dist, vsw, reference_long)
+        dates = fine_times.to_value('iso', subfmt='date_hm')
+
+        i = 0
+        for length in seg_lengths:
+            seg = slice(i, i + length)
+            for w_start, w_end, closest, w_closest in _windows(dates[seg], fine_sep[seg], np.abs(fine_sep[seg]) <= max_sep):
+                rows.append({'Spacecraft / body': body,
+                             'Start': str(w_start),
+                             'End': str(w_end),
+                             'Duration [h]': round((Time(w_end) - Time(w_start)).to_value('hr'), 2),
+                             'Closest separation [°]': round(float(closest), 1) + 0.0,  # no "-0.0"
+                             'Time of closest separation': str(w_closest)})
+            i += length
+    return pd.DataFrame(rows, columns=['Spacecraft / body', 'Start', 'End', 'Duration [h]',
+                                       'Closest separation [°]', 'Time of closest separation'])
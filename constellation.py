@@ -0,0 +1,241 @@
+import concurrent.futures
+import io
+import os
+import time
+
+import matplotlib.pyplot as plt
+import streamlit as st
+from astropy.time import Time
+
+import timing
+from ephemeris import constellation_from_positions, get_positions
+
+# maximum number of SolarMACH objects kept in memory (shared by all sessions)
+MAX_CONSTELLATIONS = 64
+# maximum number of body positions kept in memory (shared by all sessions)
+MAX_POSITIONS = 1024
+# maximum number of rendered figures (png, svg, ...) kept in memory (shared by all sessions)
+MAX_FIGURES = 128
+# maximum number of matplotlib figures kept to export them into further formats
+MAX_FIGURE_OBJECTS = 8
+# maximum number of exported tables kept in memory (shared by all sessions)
+MAX_EXPORTS = 128
+# seconds after which a constellation that lacks bodies (no ephemeris found,
+# e.g. because JPL Horizons had a problem) is obtained again
+NO_EPHEMERIS_TTL = 10 * 60
+
+# figure export formats: file name suffix, mime type, and savefig options
+FIGURE_FORMATS = {'png': ('.png', 'image/png', dict(format='png')),
+                  'svg': ('.svg', 'image/svg+xml', dict(format='svg')),
+                  'pdf': ('.pdf', 'application/pdf', dict(format='pdf')),
+                  'thumbnail': ('_thumbnail.png', 'image/png', dict(format='png', dpi=30))}
+
+# table export formats and their mime types
+EXPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet', 'json': 'application/json'}
+
+# SolarMACH.plot() sends the figure to the page by itself if it's called from
+# the Streamlit script thread. Plotting in a separate thread avoids that, so
+# that the figure is only rendered once into a png that can be cached. The
+# number of render threads caps the CPU used for plotting by all sessions;
+# more than 1 is not recommended, as pyplot's state is global.
+RENDER_WORKERS = int(os.environ.get('SOLARMACH_RENDER_WORKERS', 1))
+_render_executor = concurrent.futures.ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='render')
+
+
+@st.cache_resource(max_entries=MAX_POSITIONS, show_spinner=False)
+def get_body_position(body, date, coord_sys):
+    """
+    Obtain position of body at date (from the snapshot store if possible)
+    only once per body, so that adding a body to a constellation or changing
+    a speed doesn't obtain the positions of all bodies again. Raises
+    ValueError or RuntimeError if there is no ephemeris for body; these
+    aren't cached, as they can also be caused by a JPL Horizons outage.
+    """
+    timing.count_cache('position', miss=True)
+    return get_positions(body, Time(date), coord_sys)
+
+
+@st.cache_resource(max_entries=MAX_CONSTELLATIONS, show_spinner="Obtaining positions of selected bodies...")
+def _get_constellation(key, _state, _positions=None):
+    timing.count_cache('constellation', miss=True)
+    date = _state.timestamp
+    body_list, vsw_list = _state.bodies, _state.speeds
+    reference_long, reference_lat = _state.reference
+    coord_sys = _state.coord_sys_name
+
+    def position(body):
+        # position obtained beforehand (e.g. for several dates at once), or cached per body
+        if _positions is not None and _positions.get(body) is not None:
+            return _positions[body]
+        timing.count_cache('position')
+        try:
+            return get_body_position(body, date, coord_sys)
+        except (ValueError, RuntimeError):
+            print('!!! No ephemeris for target "' + str(body) + '" for date ' + str(date))
+            return None
+
+    with timing.stage('SolarMACH construction'):
+        pos_E = position('Earth')
+        if pos_E is None:
+            raise ValueError(f'No ephemeris found for Earth for date {date}, there probably is a problem with JPL Horizons.')
+        positions = {}
+        for body in body_list:
+            pos = position(body)
+            if pos is not None:
+                positions[body] = pos
+        c = constellation_from_positions(Time(date), pos_E, positions, dict(zip(body_list, vsw_list)),
+                                         reference_long, reference_lat, coord_sys)
+        c.missing_bodies = tuple(body for body in body_list if body not in positions)
+        c.created = time.monotonic()
+        return c
+
+
+def get_constellation(state, positions=None):
+    """
+    Initialize SolarMACH only once per constellation, i.e. per
+    state.constellation_key (see app_state.py); plot options are not part of
+    it. The positions are cached per body (get_body_position), so only those
+    of new bodies are obtained; footpoints and separations are calculated for
+    all bodies at once; positions (dict of body: SkyCoord at the date of
+    state) can provide them beforehand. The returned object is shared, so
+    its coord_table must not be modified.
+
+    Constellations that lack bodies without ephemeris are only kept for
+    NO_EPHEMERIS_TTL seconds; see content_key() for results derived from them.
+    """
+    c = _get_constellation(state.constellation_key, state, positions)
+    if c.missing_bodies and time.monotonic() - c.created > NO_EPHEMERIS_TTL:
+        _get_constellation.clear(state.constellation_key, state, positions)
+        c = _get_constellation(state.constellation_key, state, positions)
+    return c
+
+
+def content_key(key, c):
+    """
+    cache key of results derived from constellation c: key, plus the bodies
+    missing from c, so that such results are computed again once c is
+    obtained completely
+    """
+    missing = getattr(c, 'missing_bodies', ())
+    return key if not missing else key + '|' + ','.join(missing)
+
+
+def _plot(c, plot_kwargs):
+    try:
+        fig, ax = c.plot(return_plot_object=True, **plot_kwargs)
+    finally:
+        # remove figure from pyplot's global state, also if plotting failed; it
+        # can still be saved afterwards. SolarMACH keeps the axes as c.ax,
+        # which would keep the figure alive as long as the (cached) c.
+        if getattr(c, 'ax', None) is not None:
+            plt.close(c.ax.figure)
+        c.ax = None
+    return fig
+
+
+def plot_figure(c, plot_kwargs):
+    """
+    Plot constellation c with plot_kwargs in the render thread and return the
+    matplotlib figure, which is not displayed on the page.
+    """
+    with timing.stage('plot'):
+        return _render_executor.submit(_plot, c, plot_kwargs).result()
+
+
+@st.cache_resource(max_entries=MAX_FIGURE_OBJECTS, show_spinner=False)
+def get_figure(key, _c, _plot_kwargs):
+    """
+    Plot constellation _c with _plot_kwargs once per key (see
+    render_figure) and keep the figure, so that further formats can be
+    exported without plotting again. The figure is already closed in pyplot,
+    so it's freed as soon as it's dropped from this cache.
+    """
+    return plot_figure(_c, _plot_kwargs)
+
+
+def _savefig(fig, options):
+    image = io.BytesIO()
+    fig.savefig(image, bbox_inches="tight", **options)
+    return image.getvalue()
+
+
+def save_figure(fig, options):
+    """
+    save fig with savefig options and return the file content
+    """
+    with timing.stage('savefig'):
+        # in the render thread, as the figure might be saved by several sessions at once
+        return _render_executor.submit(_savefig, fig, options).result()
+
+
+@st.cache_data(max_entries=MAX_FIGURES, show_spinner=False)
+def _render_figure(key, fmt, _c, _plot_kwargs):
+    timing.count_cache('figure', miss=True)
+    return save_figure(get_figure(key, _c, _plot_kwargs), FIGURE_FORMATS[fmt][2])
+
+
+def render_figure(key, fmt, c, plot_kwargs):
+    """
+    Plot constellation c with plot_kwargs and return the figure as fmt (one
+    of FIGURE_FORMATS). Cached on key, the hash of the full state
+    (AppState.key), which therefore has to define c and plot_kwargs
+    completely. Every format is only rendered when it's requested.
+    """
+    timing.count_cache('figure')
+    return _render_figure(content_key(key, c), fmt, c, plot_kwargs)
+
+
+def table_columns(coord_sys):
+    """
+    mapping of SolarMACH.coord_table column names to the ones shown in the app
+    """
+    return {"Spacecraft/Body": "Spacecraft / body",
+            f"{coord_sys} longitude (°)": f"{coord_sys} longitude [°]",
+            f"{coord_sys} latitude (°)": f"{coord_sys} latitude [°]",
+            "Heliocentric distance (AU)": "Heliocent. distance [AU]",
+            "Longitudinal separation to Earth's longitude": "Longitud. separation to Earth longitude [°]",
+            "Latitudinal separation to Earth's latitude": "Latitud. separation to Earth latitude [°]",
+            "Vsw": "Solar wind speed [km/s]",
+            f"Magnetic footpoint longitude ({coord_sys})": f"Magnetic footpoint {coord_sys} longitude [°]",
+            "Longitudinal separation between body and reference_long": "Longitud. separation bw. body & reference [°]",
+            "Longitudinal separation between body's magnetic footpoint and reference_long": "Longitud. separation bw. body's magnetic footpoint & reference [°]",
+            "Latitudinal separation between body and reference_lat": "Latitudinal separation bw. body & reference [°]"}
+
+
+def rename_table(coord_table, coord_sys):
+    """
+    return copy of coord_table indexed by body and with the column names
+    shown in the app
+    """
+    return coord_table.set_index('Spacecraft/Body').rename(columns=table_columns(coord_sys))
+
+
+def format_table(coord_table, coord_sys, decimals=1):
+    """
+    return copy of coord_table renamed like rename_table() and formatted for
+    display: all numbers rounded to decimals (distance to 2) and converted to
+    str, in a single pass
+    """
+    df = rename_table(coord_table, coord_sys)
+    digits = {column: decimals for column in df.columns}
+    digits["Heliocent. distance [AU]"] = 2
+    return df.round(digits).astype(str)
+
+
+@st.cache_data(max_entries=MAX_EXPORTS, show_spinner=False)
+def _export_table(key, fmt, _coord_table):
+    if fmt == 'parquet':
+        return _coord_table.to_parquet(index=False)
+    if fmt == 'json':
+        return _coord_table.to_json(orient='records', indent=1)
+    return _coord_table.to_csv(index=False)
+
+
+def export_table(key, fmt, c):
+    """
+    Serialize the coord_table of constellation c as fmt (one of
+    EXPORT_FORMATS). Meant to be called only when the table is downloaded;
+    cached on key, the hash of the parameters that define the constellation
+    (AppState.constellation_key).
+    """
+    return _export_table(content_key(key, c), fmt, c.coord_table)
@@ -0,0 +1,179 @@
+import astropy.units as u
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+from sunpy.coordinates import frames, get_horizons_coord
+from solarmach import SolarMACH, backmapping_angle, body_dict
+
+import snapshot
+
+
+def body_info(body):
+    """
+    return JPL Horizons ID, label and color of body as used by SolarMACH
+    """
+    if body in body_dict:
+        return tuple(body_dict[body][:3])
+    return body, str(body), 'grey'
+
+
+def get_positions(body, times, coord_sys='Carrington'):
+    """
+    Obtain the positions of body for all times (astropy Time array) from the
+    local snapshot store if it covers them, otherwise with a single JPL
+    Horizons query. Returns SkyCoord array in coord_sys.
+    """
+    pos = snapshot.get_positions(body, times)
+    if pos is None:
+        pos = get_horizons_coord(body_info(body)[0], times, None)
+    if coord_sys == 'Carrington':
+        pos = pos.transform_to(frames.HeliographicCarrington(observer='Sun'))
+    return pos
+
+
+def get_all_positions(body_list, times, coord_sys='Carrington'):
+    """
+    Obtain positions of Earth and all bodies for all times. Bodies without
+    ephemeris in this time range are skipped, like in SolarMACH.
+
+    Returns
+    -------
+    pos_E: SkyCoord array
+        positions of Earth
+    positions: dict
+        body -> SkyCoord array
+    """
+    pos_E = get_positions(399, times, coord_sys)
+    positions = {}
+    for body in body_list:
+        try:
+            positions[body] = get_positions(body, times, coord_sys)
+        except (ValueError, RuntimeError):
+            print('!!! No ephemeris for target "' + str(body) + '" between ' + str(times[0]) + ' and ' + str(times[-1]))
+    return pos_E, positions
+
+
+def footpoint_longitude(lon, lat, dist, vsw, target_solar_radius=1, diff_rot=True):
+    """
+    Magnetic footpoint longitude (deg) and backmapping angle (deg) for
+    arrays of body longitudes (deg), latitudes (deg), heliocentric distances
+    (AU) and solar wind speeds (km/s); all inputs are broadcast against each
+    other.
+    """
+    alpha = backmapping_angle(np.asarray(dist)*u.AU, target_solar_radius*u.R_sun, np.asarray(lat)*u.deg,
+                              np.asarray(vsw)*u.km/u.s, diff_rot=diff_rot).to_value(u.deg)
+    footp_long = np.asarray(lon) + alpha
+    footp_long = np.where(footp_long > 360, footp_long - 360, footp_long)
+    return footp_long, alpha
+
+
+def footpoint_sweep(c, speeds):
+    """
+    Magnetic footpoint longitudes (deg) of all bodies of SolarMACH object c
+    for all solar wind speeds (km/s), computed in one vectorized pass over
+    the (body x speed) grid. Returns DataFrame with the bodies as index and
+    the speeds as columns.
+    """
+    bodies = list(c.body_dict)
+    pos = [c.body_dict[body][3] for body in bodies]
+    lon = np.array([p.lon.value for p in pos])[:, np.newaxis]
+    lat = np.array([p.lat.value for p in pos])[:, np.newaxis]
+    dist = np.array([p.radius.to_value(u.AU) for p in pos])[:, np.newaxis]
+    footp_long, alpha = footpoint_longitude(lon, lat, dist, np.asarray(speeds, dtype=float)[np.newaxis, :],
+                                            c.target_solar_radius, c.diff_rot)
+    return pd.DataFrame(footp_long, index=pd.Index(bodies, name='Spacecraft/Body'), columns=pd.Index(speeds, name='Vsw'))
+
+
+def coord_table(times, pos_E, positions, vsw_dict, reference_long=None, reference_lat=None, coord_sys='Carrington', target_solar_radius=1, diff_rot=True):
+    """
+    Calculate the columns of SolarMACH.coord_table for all times at once.
+    Returns the tables of all times stacked into one DataFrame with an
+    additional first column 'Date' (ordered by date, then by body).
+
+    vsw_dict maps body -> solar wind speed (number or array over times).
+    """
+    dates = times.to_value('iso', subfmt='date_hm')
+    lon_E = pos_E.lon.value
+    lat_E = pos_E.lat.value
+    tables = []
+    for body, pos in positions.items():
+        lon = pos.lon.value
+        lat = pos.lat.value
+        dist = pos.radius.to_value(u.AU)
+        vsw = np.broadcast_to(np.asarray(vsw_dict[body], dtype=float), lon.shape)
+        longsep_E = lon - lon_E
+        longsep_E = np.where(longsep_E > 180, longsep_E - 360., longsep_E)
+        footp_long, alpha = footpoint_longitude(lon, lat, dist, vsw, target_solar_radius, diff_rot)
+        table = pd.DataFrame({'Date': dates,
+                              'Spacecraft/Body': body,
+                              f'{coord_sys} longitude (°)': lon,
+                              f'{coord_sys} latitude (°)': lat,
+                              'Heliocentric distance (AU)': dist,
+                              "Longitudinal separation to Earth's longitude": longsep_E,
+                              "Latitudinal separation to Earth's latitude": lat - lat_E,
+                              'Vsw': vsw,
+                              f'Magnetic footpoint longitude ({coord_sys})': footp_long})
+        if reference_long is not None:
+            long_sep = lon - reference_long
+            long_sep = np.where(long_sep > 180, long_sep - 360., long_sep)
+            sep = lon + alpha - reference_long
+            sep = np.where(sep > 180., sep - 360, sep)
+            sep = np.where(sep < -180., 360 + sep, sep)
+            table['Longitudinal separation between body and reference_long'] = long_sep
+            table["Longitudinal separation between body's magnetic footpoint and reference_long"] = sep
+        if reference_lat is not None:
+            table['Latitudinal separation between body and reference_lat'] = lat - reference_lat
+        table['_order'] = len(tables)
+        tables.append(table)
+    table = pd.concat(tables, ignore_index=True).sort_values(['Date', '_order'], kind='stable')
+    return table.drop(columns=['_order']).reset_index(drop=True)
+
+
+def make_constellation(time, pos_E, positions, vsw_dict, reference_long=None, reference_lat=None, coord_sys='Carrington'):
+    """
+    Build a SolarMACH object for one point in time from already obtained
+    positions (scalar SkyCoords), i.e. without querying JPL Horizons again.
+    The result can be plotted like a regular SolarMACH object.
+    """
+    c = SolarMACH.__new__(SolarMACH)
+    c.diff_rot = True
+    c.target_solar_radius = 1
+    c.date = time
+    c.reference_long = reference_long
+    c.reference_lat = reference_lat
+    c.coord_sys = coord_sys
+    c.pos_E = pos_E
+    c.body_dict = {}
+    for body, pos in positions.items():
+        body_id, body_lab, body_color = body_info(body)
+        c.body_dict[body] = [body_id, body_lab, body_color, pos, vsw_dict[body]]
+    dists = [pos.radius.value for pos in positions.values()]
+    c.max_dist = np.max(dists)
+    c.max_dist_lat = list(positions.values())[np.argmax(dists)].lat.value
+    return c
+
+
+def build_constellation(date, body_list, vsw_list, reference_long=None, reference_lat=None, coord_sys='Carrington', **kwargs):
+    """
+    Same as SolarMACH(date, body_list, vsw_list, ..., **kwargs), but if date
+    is inside the local snapshot store, the positions are taken from there
+    instead of JPL Horizons (bodies not contained in the store are still
+    queried).
+    """
+    times = Time([date])
+    if snapshot.get_positions('Earth', times) is None:
+        return SolarMACH(date, list(body_list), list(vsw_list), reference_long, reference_lat, coord_sys, **kwargs)
+    pos_E, positions = get_all_positions(body_list, times, coord_sys)
+    return constellation_from_positions(times[0], pos_E[0], {body: pos[0] for body, pos in positions.items()},
+                                        dict(zip(body_list, vsw_list)), reference_long, reference_lat, coord_sys)
+
+
+def constellation_from_positions(time, pos_E, positions, vsw_dict, reference_long=None, reference_lat=None, coord_sys='Carrington'):
+    """
+    Same as make_constellation(), but also calculates the coord_table of the
+    SolarMACH object, i.e. it's complete as if initialized regularly.
+    """
+    c = make_constellation(time, pos_E, positions, vsw_dict, reference_long, reference_lat, coord_sys)
+    c.coord_table = coord_table(time.reshape((1,)), pos_E.reshape((1,)), {body: pos.reshape((1,)) for body, pos in positions.items()},
+                                vsw_dict, reference_long, reference_lat, coord_sys).drop(columns=['Date'])
+    return c
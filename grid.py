@@ -0,0 +1,172 @@
+"""
+Comparison of the constellations of several events in one figure.
+
+All events use the bodies and plot options of one AppState and only differ in
+date and time. The solar wind speed of a body is the one measured at the event
+if it has been obtained before (cache or snapshot store), otherwise the one of
+the AppState. The positions of each body are obtained for all
+events with one query, the constellations and panels share the caches of the
+single-event view (so a panel that has been shown before isn't computed
+again), and the panels are combined into one image with a grid of subplots.
+"""
+import dataclasses
+import io
+import math
+
+import pandas as pd
+import streamlit as st
+from astropy.time import Time
+from PIL import Image
+
+import timing
+from constellation import content_key, get_constellation, get_figure, rename_table, save_figure
+from ephemeris import get_positions
+from sw_speed import cached_sw_speed
+
+# maximum number of events of one grid
+MAX_EVENTS = 12
+# maximum number of grids and panels kept in memory (shared by all sessions)
+MAX_GRIDS = 16
+MAX_PANELS = 128
+# savefig options of the panels, smaller than the figure of the app
+PANEL_OPTIONS = dict(format='png', dpi=80)
+
+
+def parse_events(text):
+    """
+    Parse events given as one date (and time) per line, e.g. "2024-05-01
+    12:30" or "20240501 1230", into a list of (YYYYMMDD, HHMM); raises
+    ValueError for invalid lines or too many events.
+    """
+    events = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            dtime = pd.Timestamp(line.strip())
+        except ValueError:
+            raise ValueError(f'Invalid date "{line.strip()}", use e.g. 2024-05-01 12:30.')
+        events.append((dtime.strftime("%Y%m%d"), dtime.strftime("%H%M")))
+    if len(events) > MAX_EVENTS:
+        raise ValueError(f'Too many events ({len(events)}), the maximum is {MAX_EVENTS}.')
+    return events
+
+
+def measured_speeds(state, event):
+    """
+    dict of body: solar wind speed measured at event (an AppState) for the
+    bodies of which it has been obtained before; empty for the event of
+    state itself, whose speeds have been chosen by the user
+    """
+    if (event.date, event.time) == (state.date, state.time):
+        return {}
+    measured = {}
+    for body in event.bodies:
+        cached = cached_sw_speed(body, event.timestamp)
+        if cached is not None and cached['vsw'] is not None:
+            measured[body] = int(cached['vsw'])
+    return measured
+
+
+def event_states(state, events):
+    """
+    one AppState per event (YYYYMMDD, HHMM), otherwise like state except for
+    the speeds measured at the event (see measured_speeds)
+    """
+    states = []
+    for date, time in events:
+        event = dataclasses.replace(state, date=date, time=time)
+        measured = measured_speeds(state, event)
+        states.append(dataclasses.replace(event, speeds=tuple(measured.get(body, vsw) for body, vsw in zip(event.bodies, event.speeds))))
+    return states
+
+
+@st.cache_resource(max_entries=MAX_GRIDS * 8, show_spinner=False)
+def get_body_positions(body, dates, coord_sys):
+    """
+    Obtain positions of body at all dates (tuple) with one query and return
+    a list of them. Raises ValueError or RuntimeError (which aren't cached)
+    if there is no ephemeris for at least one date.
+    """
+    timing.count_cache('positions', miss=True)
+    pos = get_positions(body, Time(list(dates)), coord_sys)
+    return [pos[i] for i in range(len(dates))]
+
+
+def get_constellations(states):
+    """
+    constellations of all states (which only differ in date and time); the
+    positions of bodies that can't be obtained for all dates at once are
+    obtained per date
+    """
+    dates = tuple(state.timestamp for state in states)
+    positions = {}
+    for body in ['Earth'] + list(states[0].bodies):
+        timing.count_cache('positions')
+        try:
+            positions[body] = get_body_positions(body, dates, states[0].coord_sys_name)
+        except (ValueError, RuntimeError):
+            pass
+    result = []
+    for i, state in enumerate(states):
+        timing.count_cache('constellation')
+        result.append(get_constellation(state, {body: pos[i] for body, pos in positions.items()}))
+    return result
+
+
+@st.cache_data(max_entries=MAX_PANELS, show_spinner=False)
+def render_panel(key, _c, _plot_kwargs):
+    """
+    png of the figure of constellation _c with PANEL_OPTIONS; cached on key
+    (content_key() of AppState.key), and plotted only once with the figure of
+    the app
+    """
+    return save_figure(get_figure(key, _c, _plot_kwargs), PANEL_OPTIONS)
+
+
+def _combine(panels, ncols, transparent):
+    # grid of png panels (of possibly different size) as one png
+    images = [Image.open(io.BytesIO(panel)).convert('RGBA') for panel in panels]
+    width = max(image.width for image in images)
+    height = max(image.height for image in images)
+    nrows = math.ceil(len(images) / ncols)
+    background = (255, 255, 255, 0) if transparent else (255, 255, 255, 255)
+    grid = Image.new('RGBA', (ncols * width, nrows * height), background)
+    for i, image in enumerate(images):
+        row, col = divmod(i, ncols)
+        grid.paste(image, (col * width + (width - image.width) // 2, row * height + (height - image.height) // 2), image)
+    result = io.BytesIO()
+    grid.save(result, format='png')
+    return result.getvalue()
+
+
+@st.cache_data(max_entries=MAX_GRIDS, show_spinner=False)
+def render_grid(keys, ncols, transparent, _panels):
+    """
+    combine _panels (png) into one png with ncols columns; cached on the
+    keys of the panels
+    """
+    with timing.stage('grid'):
+        return _combine(_panels, ncols, transparent)
+
+
+def compare_events(state, states, ncols):
+    """
+    Figure (png) with one panel per event (AppStates of event_states(state,
+    ...)) in ncols columns, and the combined coordinate table with one row per
+    event and body, including whether the speed has been measured at the
+    event or is the one of state.
+    """
+    constellations = get_constellations(states)
+    keys = [content_key(event.key, c) for event, c in zip(states, constellations)]
+    panels = [render_panel(key, c, event.plot_kwargs()) for key, event, c in zip(keys, states, constellations)]
+    png = render_grid(tuple(keys), ncols, state.plot_trans, panels)
+    tables = []
+    for event, c in zip(states, constellations):
+        df = rename_table(c.coord_table, event.coord_sys_name).reset_index()
+        df = df.rename(columns={'Spacecraft/Body': 'Spacecraft / body'})
+        df.insert(0, 'Date', event.timestamp[:16])
+        measured = measured_speeds(state, event)
+        df['Solar wind speed source'] = ['measured' if body in measured else 'selected' for body in df['Spacecraft / body']]
+        tables.append(df)
+    return png, pd.concat(tables, ignore_index=True)
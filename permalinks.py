@@ -0,0 +1,34 @@
+from app_state import canonical_hash, canonical_params
+from cache_store import SQLiteCache
+
+# permalinks are only dropped if there are more than max_entries of them
+# (least recently used first), or if they haven't been used for TTL seconds
+PERMALINK_TTL = 10 * 365 * 24 * 60 * 60
+PERMALINK_STORE = SQLiteCache('permalinks.sqlite', max_entries=100000)
+# length of the permalink IDs (url-safe base64 characters of a sha256 hash)
+ID_LENGTH = 10
+
+
+def permalink_id(params):
+    """
+    compact ID derived from the hash of the canonical parameter set, i.e.
+    the beginning of AppState.key for parameters as returned by to_params()
+    """
+    return canonical_hash(params)[:ID_LENGTH]
+
+
+def save_permalink(params, store=PERMALINK_STORE):
+    """
+    store parameter set and return its permalink ID
+    """
+    link_id = permalink_id(params)
+    store.set(link_id, canonical_params(params), PERMALINK_TTL)
+    return link_id
+
+
+def resolve_permalink(link_id, store=PERMALINK_STORE):
+    """
+    return parameter set (dict of lists) of permalink ID, or None if unknown;
+    the permalink then expires PERMALINK_TTL after this use
+    """
+    return store.get(str(link_id), refresh_ttl=PERMALINK_TTL)
@@ -0,0 +1,336 @@
+"""
+Local snapshot store of body positions and solar wind speeds.
+
+The store is a directory with a regular time grid (default: hourly) over a
+configurable date range, containing the heliocentric positions of a list of
+bodies and Earth (positions.npy, Stonyhurst cartesian coordinates in AU) and
+the measured solar wind speeds as solarmach.get_sw_speed would return them
+(vsw.npy, NaN if no measurement was found), obtained in large chunks per body.
+The arrays are memory-mapped, so loading the store is instant and only the
+parts that are used are read from disk.
+
+Inside the date range of the store, positions are linearly interpolated and
+solar wind speeds are taken from the nearest grid point, without querying JPL
+Horizons or AMDA/CDAWeb. Everything outside of it (or bodies not contained in
+it) is obtained from the network as usual. This keeps the app working with
+constant latency when the upstream services are down.
+
+Build or update the store (located in SNAPSHOT_DIR) with, e.g.:
+    python snapshot.py 2024-01-01 2026-12-31
+    python snapshot.py 2024-01-01 2026-12-31 --bodies Earth "Solar Orbiter" --step 1 --no-vsw
+"""
+import argparse
+import concurrent.futures
+import datetime
+import functools
+import json
+import os
+import shutil
+import sys
+
+import astropy.units as u
+import numpy as np
+import pandas as pd
+from astropy.coordinates import CartesianRepresentation, SkyCoord
+from astropy.time import Time, TimeDelta
+from solarmach import body_dict
+from sunpy.coordinates import frames, get_horizons_coord
+
+from app_state import DEFAULT_BODIES
+from cache_store import CACHE_DIR
+
+SNAPSHOT_DIR = os.environ.get('SOLARMACH_SNAPSHOT_DIR', os.path.join(CACHE_DIR, 'snapshot'))
+
+# number of days for which positions are obtained with one JPL Horizons query
+CHUNK_DAYS = 30
+# number of days for which solar wind speeds are obtained with one speasy query
+VSW_CHUNK_DAYS = 30
+# speasy data provider and parameter of the solar wind speed of each body, as
+# used by solarmach.get_sw_speed (Earth and SEMB-L1 use ACE)
+SW_DATASETS = {'ACE': ('cda', 'ACE.SWE.AC_K1_SWE.Vp'),
+               'SOHO': ('cda', 'SOHO.CELIAS_PM.SOHO_CELIAS_PM_5MIN.V_p'),
+               'Parker Solar Probe': ('amda', 'Parameters.PSP.SWEAP_SPC.psp_spc_mom.psp_spc_vp_mom_nrm'),
+               'Solar Orbiter': ('amda', 'Parameters.SolarOrbiter.SWAPAS.L2.so_pas_momgr1.pas_momgr1_v_rtn_tot'),
+               'STEREO A': ('amda', 'Parameters.STEREO.STEREO_A.PLASTIC.sta_l2_pla.vpbulk_sta'),
+               'STEREO B': ('amda', 'Parameters.STEREO.STEREO_B.PLASTIC.stb_l2_pla.vpbulk_stb'),
+               'Wind': ('amda', 'Parameters.Wind.SWE.wnd_swe_kp.wnd_swe_vmag')}
+# value of grid points for which the solar wind lookup failed (e.g. service
+# down), in contrast to NaN for "no measurement found"
+VSW_FAILED = -1.0
+
+
+def _horizons_id(body):
+    # JPL Horizons ID of body as used by SolarMACH
+    if body in body_dict:
+        return body_dict[body][0]
+    return body
+
+
+def _body_id(body):
+    # key of body in the store
+    return str(_horizons_id(body))
+
+
+class Snapshot():
+    """
+    Read-only access to a snapshot store directory written by build()
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.start = Time(meta['start'])
+        self.step = meta['step']
+        self.ids = {body_id: i for i, body_id in enumerate(meta['ids'])}
+        self.positions_grid = np.load(os.path.join(path, 'positions.npy'), mmap_mode='r')
+        vsw_file = os.path.join(path, 'vsw.npy')
+        self.vsw_grid = np.load(vsw_file, mmap_mode='r') if os.path.exists(vsw_file) else None
+
+    def _index(self, times):
+        # fractional index of times in grid, or None if any of them is outside of it
+        index = np.atleast_1d((Time(times) - self.start).to_value('hr') / self.step)
+        if index.min() < 0 or index.max() > self.positions_grid.shape[1] - 1:
+            return None
+        return index
+
+    def positions(self, body, times):
+        """
+        Stonyhurst SkyCoord (array) of body at times (astropy Time scalar or
+        array), or None if the store doesn't cover all of them
+        """
+        row = self.ids.get(_body_id(body))
+        index = self._index(times) if row is not None else None
+        if index is None:
+            return None
+        i = np.minimum(np.floor(index).astype(int), self.positions_grid.shape[1] - 2)
+        w = (index - i)[:, None]
+        xyz = self.positions_grid[row, i] * (1 - w) + self.positions_grid[row, i + 1] * w
+        if np.isnan(xyz).any():
+            return None
+        if Time(times).isscalar:
+            xyz = xyz[0]
+        pos = SkyCoord(CartesianRepresentation(xyz.T * u.AU), frame=frames.HeliographicStonyhurst, obstime=times)
+        # same representation as obtained from JPL Horizons: (lon, lat, radius)
+        pos.representation_type = 'spherical'
+        return pos
+
+    def sw_speed(self, body, date):
+        """
+        measured solar wind speed of body at date, NaN if there is no
+        measurement, or None if the store doesn't cover it
+        """
+        row = self.ids.get(_body_id(body))
+        if self.vsw_grid is None or row is None:
+            return None
+        index = self._index(Time(date))
+        if index is None:
+            return None
+        vsw = float(self.vsw_grid[row, int(np.round(index[0]))])
+        if vsw == VSW_FAILED:
+            return None
+        return vsw
+
+
+@functools.lru_cache(maxsize=1)
+def _load(path, mtime):
+    return Snapshot(path)
+
+
+def get_snapshot(path=SNAPSHOT_DIR):
+    """
+    Snapshot store in path, or None if there is none. Loaded once per process,
+    and again if it has been rebuilt in the meantime.
+    """
+    try:
+        mtime = os.stat(os.path.join(path, 'meta.json')).st_mtime
+    except OSError:
+        return None
+    return _load(path, mtime)
+
+
+def get_positions(body, times):
+    """
+    positions of body at times from the snapshot store, or None
+    """
+    store = get_snapshot()
+    if store is None:
+        return None
+    return store.positions(body, times)
+
+
+def get_sw_speed_snapshot(body, date):
+    """
+    solar wind speed of body at date from the snapshot store (NaN if there is
+    no measurement), or None
+    """
+    store = get_snapshot()
+    if store is None:
+        return None
+    return store.sw_speed(body, date)
+
+
+def _obtain_positions(body, times):
+    # positions of the whole grid in chunks; NaN for chunks without ephemeris
+    xyz = np.full((len(times), 3), np.nan)
+    n = int(CHUNK_DAYS * 24 / ((times[1] - times[0]).to_value('hr'))) if len(times) > 1 else 1
+    for i in range(0, len(times), n):
+        chunk = times[i:i+n]
+        try:
+            pos = get_horizons_coord(_horizons_id(body), chunk, None)
+        except (ValueError, RuntimeError):
+            print(f'!!! No ephemeris for "{body}" between {chunk[0]} and {chunk[-1]}')
+            continue
+        xyz[i:i+n] = pos.cartesian.xyz.to_value(u.AU).T
+    return xyz
+
+
+def _sw_dataset(body):
+    # speasy provider and parameter of the solar wind speed of body, or None
+    # if there are no measurements; raises ConnectionError if the provider is
+    # unavailable
+    try:
+        body = body_dict[body][1]
+    except KeyError:
+        pass
+    if body in ['Earth', 'SEMB-L1']:
+        body = 'ACE'
+    if body not in SW_DATASETS:
+        return None
+    # like solarmach.get_sw_speed, skip unused providers
+    os.environ['SPEASY_CORE_DISABLED_PROVIDERS'] = "sscweb,archive,csa"
+    import speasy as spz
+    provider, path = SW_DATASETS[body]
+    try:
+        parameter = getattr(spz.inventories.data_tree, provider)
+    except AttributeError:
+        raise ConnectionError(f"speasy's {provider.upper()} server is currently unavailable")
+    for name in path.split('.'):
+        parameter = getattr(parameter, name)
+    return provider, parameter
+
+
+def _hourly_sw_speed(provider, parameter, start, end):
+    # hourly mean solar wind speeds between start and end (pandas Series)
+    import speasy as spz
+    if provider == 'amda':
+        data = spz.get_data(parameter, start, end, output_format="CDF_ISTP")
+    else:
+        data = spz.get_data(parameter, start, end)
+    if data is None:
+        return pd.Series(dtype=float)
+    series = data.replace_fillval_by_nan().to_dataframe().iloc[:, 0]
+    if series.index.tz is not None:
+        series.index = series.index.tz_convert(None)
+    return series.resample('1h').mean().dropna()
+
+
+def _nearest_sw_speed(hourly, times, trange=1):
+    """
+    like solarmach.get_sw_speed for each of times (numpy datetime64): the
+    hourly mean (of hourly, a Series) closest to the time, if it's not more
+    than trange hours away and not negative; otherwise NaN
+    """
+    vsw = np.full(len(times), np.nan)
+    if len(hourly) == 0:
+        return vsw
+    labels = hourly.index.values.astype('datetime64[ns]')
+    values = hourly.to_numpy(dtype=float)
+    times = times.astype('datetime64[ns]')
+    right = np.clip(np.searchsorted(labels, times), 0, len(labels) - 1)
+    left = np.clip(right - 1, 0, len(labels) - 1)
+    # ties go to the later hour, as with pandas' get_indexer(method='nearest')
+    nearest = np.where(np.abs(labels[left] - times) < np.abs(labels[right] - times), left, right)
+    distance = np.abs(labels[nearest] - times) / np.timedelta64(1, 'h')
+    ok = (distance <= trange) & (values[nearest] >= 0)
+    vsw[ok] = values[nearest][ok]
+    return vsw
+
+
+def _obtain_sw_speeds(body, times, trange=1):
+    """
+    solar wind speeds of body at all times of the grid, obtained in chunks of
+    VSW_CHUNK_DAYS with one query each (instead of one per grid point), NaN
+    where no measurement was found, and VSW_FAILED for chunks whose query
+    failed
+    """
+    vsw = np.full(len(times), np.nan)
+    try:
+        dataset = _sw_dataset(body)
+    except Exception:
+        vsw[:] = VSW_FAILED
+        return vsw
+    if dataset is None:
+        return vsw
+    n = int(VSW_CHUNK_DAYS * 24 / ((times[1] - times[0]).to_value('hr'))) if len(times) > 1 else 1
+    for i in range(0, len(times), n):
+        chunk = times[i:i+n].datetime64
+        start = pd.Timestamp(chunk[0]).to_pydatetime() - datetime.timedelta(hours=trange)
+        end = pd.Timestamp(chunk[-1]).to_pydatetime() + datetime.timedelta(hours=trange)
+        try:
+            hourly = _hourly_sw_speed(*dataset, start, end)
+        except Exception:
+            print(f'!!! Solar wind speeds of "{body}" between {chunk[0]} and {chunk[-1]} could not be obtained')
+            vsw[i:i+n] = VSW_FAILED
+            continue
+        vsw[i:i+n] = _nearest_sw_speed(hourly, chunk, trange)
+    return vsw
+
+
+def build(start, end, step=1, bodies=DEFAULT_BODIES, vsw=True, path=SNAPSHOT_DIR, workers=6):
+    """
+    Obtain positions (and solar wind speeds if vsw) of Earth and all bodies
+    from start to end every step hours and write them into a new store in
+    path, replacing the existing one only when it's complete.
+    """
+    start = Time(start)
+    n = int(np.floor((Time(end) - start).to_value('hr') / step)) + 1
+    times = start + TimeDelta(np.arange(n) * step * 3600, format='sec')
+    # one row per Horizons ID, e.g. 'PSP' and 'Parker Solar Probe' are the same
+    body_ids = {}
+    for body in ['Earth'] + list(bodies):
+        body_ids.setdefault(_body_id(body), body)
+    ids = list(body_ids)
+
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    positions = np.lib.format.open_memmap(os.path.join(tmp_path, 'positions.npy'), mode='w+', dtype=float, shape=(len(ids), n, 3))
+    for row, body_id in enumerate(ids):
+        print(f'Obtaining positions of "{body_ids[body_id]}" for {n} times...')
+        positions[row] = _obtain_positions(body_ids[body_id], times)
+    positions.flush()
+
+    if vsw:
+        speeds = np.lib.format.open_memmap(os.path.join(tmp_path, 'vsw.npy'), mode='w+', dtype=float, shape=(len(ids), n))
+        print(f'Obtaining solar wind speeds of {len(ids)} bodies for {n} times...')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for row, vsw_row in enumerate(executor.map(lambda body_id: _obtain_sw_speeds(body_ids[body_id], times), ids)):
+                speeds[row] = vsw_row
+        speeds.flush()
+        if (speeds == VSW_FAILED).any():
+            print(f'!!! {np.sum(speeds == VSW_FAILED)} solar wind lookups failed; they will be obtained online.')
+
+    # write meta.json last; it marks the store as complete
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'start': start.isot, 'step': step, 'ids': ids}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    print(f'Snapshot store written to {path}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build local snapshot store of Solar-MACH positions and solar wind speeds.')
+    parser.add_argument('start', help='first date of the store, e.g. 2024-01-01')
+    parser.add_argument('end', help='last date of the store, e.g. 2026-12-31')
+    parser.add_argument('--step', type=float, default=1, help='time step of the grid in hours (default: 1)')
+    parser.add_argument('--bodies', nargs='+', default=DEFAULT_BODIES, help='bodies to include (Earth is always included)')
+    parser.add_argument('--no-vsw', action='store_true', help="don't obtain solar wind speeds")
+    parser.add_argument('--path', default=SNAPSHOT_DIR, help=f'directory of the store (default: {SNAPSHOT_DIR})')
+    parser.add_argument('-j', '--workers', type=int, default=6, help='number of bodies whose solar wind speeds are obtained simultaneously')
+    args = parser.parse_args(argv)
+    build(args.start, args.end, args.step, args.bodies, not args.no_vsw, args.path, args.workers)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
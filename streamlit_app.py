@@ -1,17 +1,30 @@
+import timing  # import first, marks start of first script run of process
 import datetime
-import io
+import functools
 import os
-import pyshorteners
+import shutil
+import time
 # import astropy.units as u
-import matplotlib.pyplot as plt
 # import numpy as np
-from stqdm import stqdm
+import pandas as pd
 import streamlit as st
 # import streamlit_analytics  # TODO: un-comment when streamlit-analytics has been updated with https://github.com/jrieke/streamlit-analytics/pull/44
 # import streamlit_analytics2 as streamlit_analytics
 # from astropy.coordinates import SkyCoord
 # from sunpy.coordinates import frames
-from solarmach import SolarMACH, print_body_list, get_sw_speed
+
+from app_state import APP_URL, COORD_SYS_LIST, DEFAULT_BODIES, DEFAULT_VSW, LEGACY_PARAMS, STATE_PARAMS, AppState, default_date, has_state_params, parse_params
+from bodies import MAX_BODIES, get_body_catalogue
+from connectivity import find_connection_windows
+from constellation import EXPORT_FORMATS, FIGURE_FORMATS, export_table, format_table, get_constellation, render_figure
+from ephemeris import footpoint_sweep
+from grid import MAX_EVENTS, compare_events, event_states, parse_events
+from permalinks import resolve_permalink, save_permalink
+from sw_speed import SpeedFetch, session_slots
+from timeseries import ffmpeg_available, output_dir, time_steps, write_timeseries
+from warmup import start_warmup
+
+timing.mark_startup('imports')
 
 
 def delete_from_state(vars):
@@ -102,69 +115,147 @@ def clear_url():
     st.query_params["embedded"] = 'true'
 
 
-# @st.cache_data
-def obtain_vsw(body_list, date, default_vsw):
-    vsw_list2 = []
-    obtained_vsw = {}  #[]
-    for i, body in stqdm(enumerate(body_list), desc="Obtaining solar wind speeds for selected bodies..."):
-        vsw = get_sw_speed(body, date, default_vsw=default_vsw[i])
-        vsw_list2.append(vsw)
-        if vsw==default_vsw[i]:
-            # obtained_vsw.append(-1)
-            obtained_vsw[body] = -1
-        else:
-            # obtained_vsw.append(1)
-            obtained_vsw[body] = 1
+def start_vsw_fetch(body_list, date, default_vsw):
+    # lookups run in the background; the speed inputs are updated while they arrive
+    cancel_vsw_fetch()
+    delete_from_state(["obtained_vsw"])
+    # lookups of earlier (cancelled) fetches that are still running count against the session's limit
+    slots = st.session_state.setdefault("vsw_slots", session_slots())
+    st.session_state["vsw_fetch"] = SpeedFetch(body_list, date, default_vsw, slots)
+
+
+def cancel_vsw_fetch():
+    if "vsw_fetch" in st.session_state:
+        st.session_state.pop("vsw_fetch").cancel()
+
+
+def finish_vsw_fetch():
+    """
+    Apply the speeds obtained by the finished (or cancelled) background
+    fetch; bodies without result keep their previous speed.
+    """
+    fetch = st.session_state.pop("vsw_fetch")
+    if list(st.session_state.get("bodies", [])) != fetch.body_list:
+        # selection has been changed in the meantime
+        return
+    results = fetch.results()
+    obtained_vsw = {}
+    for body, (vsw, found) in results.items():
+        obtained_vsw[body] = 1 if found else -1
     st.session_state["obtained_vsw"] = obtained_vsw
-    st.session_state["speeds"] = vsw_list2
+    st.session_state["speeds"] = [results[body][0] if body in results else vsw for body, vsw in zip(fetch.body_list, fetch.default_vsw)]
+    # hand over timings of the lookups to the script run
+    st.session_state["_callback_timings"] = fetch.timings
+
+
+def speed_inputs(body_list, date, def_vsw_dict):
+    """
+    Number inputs of the solar wind speeds of all bodies. While a background
+    fetch is running, they show the measurements as they arrive (and can't be
+    edited), and this is run as fragment every second; once the fetch is done
+    or cancelled, the whole app is run again with the final speeds.
+    """
+    fetch = st.session_state.get("vsw_fetch")
+    if fetch is None:
+        results = {}
+        st.button("Try to obtain measurements* :mag:", on_click=start_vsw_fetch, args=[body_list, date, [def_vsw_dict.get(body, 400) for body in body_list]], type='primary')
+    else:
+        if fetch.done:
+            st.rerun()
+        results = fetch.results()
+        st.progress(len(results) / max(len(fetch.body_list), 1), text=f"Obtaining solar wind speeds for selected bodies... ({len(results)}/{len(fetch.body_list)})")
+        if st.button("Cancel", type='primary'):
+            fetch.cancel()
+            st.rerun()
+    st.caption(r'\* Some data is preliminary browse data!')
+    vsw_dict = {}
+    for body in body_list:
+        obtained_vsw_status = ''
+        value = def_vsw_dict.get(body, 400)
+        if fetch is not None:
+            obtained_vsw_status = '  ⏳'
+            if body in results:
+                value, found = results[body]
+                obtained_vsw_status = '  ✅' if found else '  ❌'
+        elif "obtained_vsw" in st.session_state:
+            if st.session_state["obtained_vsw"].get(body)==-1:
+                obtained_vsw_status = '  ❌'
+            if st.session_state["obtained_vsw"].get(body)==1:
+                obtained_vsw_status = '  ✅'
+        vsw = int(st.number_input(body+obtained_vsw_status, min_value=0,
+                                  value=int(value),
+                                  step=50,
+                                  disabled=fetch is not None))  # , on_change=clear_url))
+        # while fetching, the app keeps using the previous speeds
+        vsw_dict[body] = vsw if fetch is None else int(def_vsw_dict.get(body, 400))
+    return vsw_dict
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
 
 
 def reset_vsw(body_list):
+    cancel_vsw_fetch()
     delete_from_state(["obtained_vsw"])
     st.session_state["speeds"] = [400] * len(body_list)
 
 
+# apply the speeds of a finished background fetch before anything else uses them
+if "vsw_fetch" in st.session_state and st.session_state["vsw_fetch"].done:
+    finish_vsw_fetch()
+
+# collect timings of this script run (shown in debug info and logged)
+run = timing.start_run(st.session_state.pop("_callback_timings", None))
+url_parsing_start = time.perf_counter()
+
 # obtain query paramamters from URL; convert query dictionary to old format
 query_params = {}
 for key in st.query_params.keys():
     query_params[key] = st.query_params.get_all(key)
 
-
-# define empty dict for new params to put into URL (only in box at the bottom)
-set_query_params = {}
-
-# catch old URL parameters and replace with current ones
-if ("plot_reference" in query_params) and int(query_params["plot_reference"][0]) == 1:
-    if "carr_long" in query_params and "carr_lat" in query_params and "reference_sys" in query_params and "coord_sys" not in query_params and int(query_params["reference_sys"][0]) == 0:
-        query_params["reference_long"] = query_params.pop("carr_long")
-        query_params["reference_lat"] = query_params.pop("carr_lat")
-        query_params["coord_sys"] = query_params.pop("reference_sys")
-        # query_params["coord_sys"] = ["0"]  # select Carrington coordinates
-    elif "ston_long" in query_params and "ston_lat" in query_params and "reference_sys" in query_params and "coord_sys" not in query_params and int(query_params["reference_sys"][0]) == 1:
-        query_params["reference_long"] = query_params.pop("ston_long")
-        query_params["reference_lat"] = query_params.pop("ston_lat")
-        query_params["coord_sys"] = query_params.pop("reference_sys")
-        # query_params["coord_sys"] = ["1"]  # select Stonyhurst coordinates
+# replace short URL (?s=<permalink ID>) by the parameters stored for it
+if "s" in query_params:
+    permalink = resolve_permalink(query_params.pop("s")[0])
+    if permalink is None:
+        st.error('⚠️ **WARNING:** Unknown short URL, using default parameters.')
     else:
-        if "carr_long" in query_params or "carr_lat" in query_params or "ston_long" in query_params or "ston_lat" in query_params or "reference_sys" in query_params:
-            st.error('⚠️ **WARNING:** Deprecated parameters have been prodived by the URL. To avoid unexpected behaviour, plotting of the reference has been deactivated!')
-            query_params["plot_reference"][0] = 0
-
-# saved obtained query params from URL into session_state
+        query_params = {**permalink, **query_params}
+
+
+# parse, validate, and normalize all parameters of the URL in one pass
+# (including legacy ones), and put them into the widgets
+if has_state_params(query_params):
+    url_state, messages = parse_params(query_params)
+    for message in messages:
+        st.warning(message)
+    for key, value in url_state.to_params().items():
+        st.session_state[key] = value
+    st.session_state.date_input = datetime.datetime.strptime(url_state.date, "%Y%m%d")
+    st.session_state.time_input = datetime.datetime.strptime(url_state.time, "%H%M").time()
+    st.session_state.def_plot_spirals = url_state.plot_spirals
+    st.session_state.def_plot_sun_body_line = url_state.plot_sun_body_line
+    st.session_state.def_transparent = url_state.plot_trans
+    st.session_state.def_markers = url_state.plot_markers
+    st.session_state.def_long_offset = url_state.long_offset
+    st.session_state.plot_reference_check = url_state.plot_reference
+    st.session_state.def_reference_vsw = url_state.reference_vsw
+    if not url_state.plot_reference:
+        delete_from_state(["reference_long", "reference_lat", "reference_vsw", "plot_reference"])
+# other parameters, e.g. verbose
 for i in query_params:
-    st.session_state[i] = query_params[i]
+    if i not in STATE_PARAMS + LEGACY_PARAMS:
+        st.session_state[i] = query_params[i]
+timing.record('URL parsing', time.perf_counter() - url_parsing_start)
 
 # removed as of now
 # st.sidebar.button('Get shareable URL', help='Save parameters to URL, so that it can be saved or shared with others.', on_click=make_url, args=[set_query_params])
 
 # provide date and time
 # set starting parameters from URL if available, otherwise use defaults
-if "date" in query_params:
-    st.session_state.date_input = datetime.datetime.strptime(query_params["date"][0], "%Y%m%d")
-st.sidebar.date_input("Select date", value=datetime.date.today()-datetime.timedelta(days=2), min_value=datetime.date(1970, 1, 1), key="date_input")
+st.sidebar.date_input("Select date", value=datetime.datetime.strptime(default_date(), "%Y%m%d").date(), min_value=datetime.date(1970, 1, 1), key="date_input")
 
-if "time" in query_params:
-    st.session_state.time_input = datetime.datetime.strptime(query_params["time"][0], "%H%M").time()
 st.sidebar.time_input('Select time', value=datetime.time(0, 0), key="time_input")
 
 date = datetime.datetime.combine(st.session_state.date_input, st.session_state.time_input).strftime("%Y-%m-%d %H:%M:%S")
@@ -176,9 +267,11 @@ stime = st.session_state.time_input.strftime("%H%M")
 # if changing datetime, remove obtained_vsw from session_state (bc. new vsw need to be obtained for changed datetime)
 if "date" in st.session_state.keys():
     if st.session_state["date"] != [sdate]: 
+        cancel_vsw_fetch()
         delete_from_state(["obtained_vsw"])
 if "time" in st.session_state.keys():
     if st.session_state["time"] != [stime]: 
+        cancel_vsw_fetch()
         delete_from_state(["obtained_vsw"])
 
 st.session_state["date"] = [sdate]
@@ -187,22 +280,17 @@ st.session_state["time"] = [stime]
 
 # plotting settings
 with st.sidebar.container():
-    coord_sys_list = ['Carrington', 'Stonyhurst']
     # set starting parameters from URL if available, otherwise use defaults
     # def_reference_sys = int(query_params["reference_sys"][0]) if "reference_sys" in query_params else 0
     def_coord_sys = int(st.session_state["coord_sys"][0]) if "coord_sys" in st.session_state else 0
-    coord_sys = st.sidebar.radio('Coordinate system:', coord_sys_list, index=def_coord_sys, horizontal=True)  #, on_change=delete_from_state(["reference_long"]))
-    st.session_state["coord_sys"] = [str(coord_sys_list.index(coord_sys))]
+    coord_sys = st.sidebar.radio('Coordinate system:', COORD_SYS_LIST, index=def_coord_sys, horizontal=True)  #, on_change=delete_from_state(["reference_long"]))
+    st.session_state["coord_sys"] = [str(COORD_SYS_LIST.index(coord_sys))]
 
     st.sidebar.subheader('Plot options:')
 
-    if ("plot_spirals" in query_params) and int(query_params["plot_spirals"][0]) == 0:
-        st.session_state.def_plot_spirals = False
     st.sidebar.checkbox('Parker spiral for each body', value=True, key='def_plot_spirals')  # , on_change=clear_url)
     st.session_state["plot_spirals"] = [1] if st.session_state.def_plot_spirals else [0]
 
-    if ("plot_sun_body_line" in query_params) and int(query_params["plot_sun_body_line"][0]) == 0:
-        st.session_state.def_plot_sun_body_line = False
     st.sidebar.checkbox('Straight line from Sun to body', value=True, key='def_plot_sun_body_line')  # , on_change=clear_url)
     st.session_state["plot_sun_body_line"] = [1] if st.session_state.def_plot_sun_body_line else [0]
 
@@ -216,32 +304,18 @@ with st.sidebar.container():
     #     set_query_params["plot_ecc"] = [1]
     #     st.session_state["plot_ecc"] = [1]
 
-    if ("plot_trans" in query_params) and int(query_params["plot_trans"][0]) == 1:
-        st.session_state.def_transparent = True
     st.sidebar.checkbox('Transparent background', value=False, key='def_transparent')  # , on_change=clear_url)
     st.session_state["plot_trans"] = [1] if st.session_state.def_transparent else [0]
 
-    # catch old URL query parameter plot_nr for numberd_markers:
-    if ("plot_nr" in query_params) and int(query_params["plot_nr"][0]) == 1:
-        st.session_state.def_markers = "Numbers"
-    if ("plot_nr" in query_params) and int(query_params["plot_nr"][0]) == 0:
-        st.session_state.def_markers = "Squares"
-    #
-    if ("plot_markers" in query_params):
-        st.session_state.def_markers = st.session_state.plot_markers[0].capitalize()
     # st.sidebar.checkbox('Numbered symbols', value=False, key='def_numbered')
     st.sidebar.radio("Plot symbol style", ["Letters", "Numbers", "Squares"], index=1, key='def_markers', horizontal=True)
     # st.session_state["plot_nr"] = [1] if st.session_state.def_numbered else [0]
     st.session_state["plot_markers"] = [st.session_state.def_markers]
 
-    if ("long_offset" in query_params):
-        st.session_state.def_long_offset = int(st.session_state["long_offset"][0])
     st.sidebar.number_input('Plot Earth at longitude (axis system, 0=3 o`clock):',
                             min_value=0, max_value=360, value=270, step=90, key='def_long_offset')
     st.session_state["long_offset"] = [str(int(st.session_state.def_long_offset))]
 
-    if ("plot_reference" in query_params) and int(query_params["plot_reference"][0]) == 1:
-        st.session_state.plot_reference_check = True
     st.sidebar.checkbox('Plot reference (e.g. flare)', value=False, key='plot_reference_check')  # , on_change=clear_url)
 
     with st.sidebar.expander("Reference coordinates (e.g. flare)", expanded=st.session_state.plot_reference_check):
@@ -269,8 +343,6 @@ with st.sidebar.container():
             reference_long = st.number_input('Longitude (-180 to 180):', min_value=-180, max_value=180, value=def_reference_long)  # , on_change=clear_url)
             reference_lat = st.number_input('Latitude (-90 to 90):', min_value=-90, max_value=90, value=def_reference_lat)  # , on_change=clear_url)
 
-        if ("reference_vsw" in query_params):
-            st.session_state.def_reference_vsw = int(query_params["reference_vsw"][0])
         st.number_input('Solar wind speed for reference (km/s)', min_value=0, value=400, step=50, key='def_reference_vsw')  # , on_change=clear_url)
 
         if st.session_state.plot_reference_check:
@@ -286,49 +358,37 @@ with st.sidebar.container():
 
 st.sidebar.subheader('Choose bodies/spacecraft and measured solar wind speeds')
 with st.sidebar.container():
-    all_bodies = print_body_list()
-
-    # rename Lx point and order body list alphabetically
-    for l in ['1', '2', '4', '5']:
-        all_bodies = all_bodies.replace(f'SEMB-L{l}', f'L{l}')
-    all_bodies = all_bodies.sort_index()
-
-    # set starting parameters from URL if available, otherwise use defaults
-    # def_full_body_list = query_params["bodies"] if "bodies" in query_params else ['STEREO A', 'Earth', 'BepiColombo', 'Parker Solar Probe', 'Solar Orbiter']
-    # def_vsw_list = [int(i) for i in query_params["speeds"]] if "speeds" in query_params else [400, 400, 400, 400, 400]
-
-    def_full_body_list = st.session_state["bodies"] if "bodies" in st.session_state else ['STEREO A', 'Earth', 'BepiColombo', 'Parker Solar Probe', 'Solar Orbiter', 'JUICE']
-    def_vsw_list = [int(i) for i in st.session_state["speeds"]] if "speeds" in st.session_state else [400, 400, 400, 400, 400, 400]
+    # cached once per process, with Lx points renamed and ordered alphabetically
+    with timing.stage('body catalogue'):
+        all_bodies = get_body_catalogue()[0]
 
-    def_vsw_dict = {}
-    for i in range(len(def_full_body_list)):
-        try:
-            def_vsw_dict[def_full_body_list[i]] = def_vsw_list[i]
-        except IndexError:
-            def_vsw_dict[def_full_body_list[i]] = 400
+    # set starting parameters from URL (already validated) if available, otherwise use defaults
+    def_full_body_list = st.session_state["bodies"] if "bodies" in st.session_state else list(DEFAULT_BODIES)
+    def_vsw_list = [int(i) for i in st.session_state["speeds"]] if "speeds" in st.session_state else [DEFAULT_VSW] * len(def_full_body_list)
+    def_vsw_dict = {body: def_vsw_list[i] if i < len(def_vsw_list) else DEFAULT_VSW for i, body in enumerate(def_full_body_list)}
 
     body_list = st.multiselect(
         'Bodies/spacecraft',
         all_bodies,
         def_full_body_list,
+        max_selections=MAX_BODIES,
         key='bodies')  # , on_change=clear_url)
 
+    # speeds of a background fetch belong to the bodies selected when it was started
+    if "vsw_fetch" in st.session_state and st.session_state["vsw_fetch"].body_list != body_list:
+        cancel_vsw_fetch()
+
     with st.sidebar.expander("Solar wind speed (km/s) per S/C", expanded=True):
-        vsw_dict = {}
-        st.button("Try to obtain measurements* :mag:", on_click=obtain_vsw, args=[body_list, date, def_vsw_list], type='primary')
-        st.caption(r'\* Some data is preliminary browse data!')
-        for i, body in enumerate(body_list):
-            if "obtained_vsw" in st.session_state:
-                if st.session_state["obtained_vsw"][body]==-1:
-                    obtained_vsw_status = '  ❌'
-                if st.session_state["obtained_vsw"][body]==1:
-                    obtained_vsw_status = '  ✅'
-            else:
-                obtained_vsw_status = ''    
-            vsw_dict[body] = int(st.number_input(body+obtained_vsw_status, min_value=0,
-                                 value=def_vsw_dict.get(body, 400),
-                                 step=50))  # , on_change=clear_url))
-        if "obtained_vsw" in st.session_state:
+        if "vsw_fetch" in st.session_state:
+            vsw_dict = st.fragment(speed_inputs, run_every=1)(body_list, date, def_vsw_dict)
+        else:
+            vsw_dict = speed_inputs(body_list, date, def_vsw_dict)
+        if "vsw_fetch" in st.session_state:
+            legend = '''✅ - measurement found
+❌ - no measurement found
+⏳ - lookup running'''
+            st.code(legend, language=None)
+        elif "obtained_vsw" in st.session_state:
             legend = '''✅ - measurement found
 ❌ - no measurement found'''
             st.code(legend, language=None)
@@ -338,61 +398,46 @@ with st.sidebar.container():
     # st.session_state["bodies"] = body_list
     st.session_state["speeds"] = vsw_list
 
-url = 'https://solar-mach.streamlit.app/?embedded=true&'
-
-# Get all the parameters from st.session_state and store them in set_query_params so you can build the url
-for p in ["date", "time", "coord_sys", "plot_spirals", "plot_sun_body_line", "plot_trans", "plot_markers",
-          "long_offset", "reference_long", "reference_lat", "reference_vsw", "plot_reference", "bodies", "speeds"]:
-    if p in st.session_state:
-        set_query_params[p] = st.session_state[p]
-
-for p in set_query_params:
-    for i in set_query_params[p]:
-        # st.write(str(p)+' '+str(i))
-        url = url + str(p)+'='+str(i)+'&'
-url = url.replace(' ', '+')
-
-# possible alternative to using set_query_params dictionary:
-# url2 = 'https://share.streamlit.io/jgieseler/solar-mach/testing/app.py?'
-# for p in st.session_state:
-#     for i in st.session_state[p]:
-#         # st.write(str(p)+' '+str(i))
-#         url2 = url2 + str(p)+'='+str(i)+'&'
-# url2 = url2.replace(' ', '+')
+# typed state of this run; the URL, the short URL, and the keys of all caches
+# are derived from its canonical form
+state = AppState(date=sdate, time=stime, bodies=tuple(body_list), speeds=tuple(vsw_list),
+                 coord_sys=COORD_SYS_LIST.index(coord_sys),
+                 plot_spirals=bool(st.session_state.def_plot_spirals),
+                 plot_sun_body_line=bool(st.session_state.def_plot_sun_body_line),
+                 plot_trans=bool(st.session_state.def_transparent),
+                 plot_markers=st.session_state.def_markers,
+                 long_offset=int(st.session_state.def_long_offset),
+                 plot_reference=bool(st.session_state.plot_reference_check),
+                 reference_long=int(reference_long) if reference_long is not None else 0,
+                 reference_lat=int(reference_lat) if reference_lat is not None else 0,
+                 reference_vsw=int(st.session_state.def_reference_vsw) if st.session_state.plot_reference_check else DEFAULT_VSW)
+url = state.url()
 
 
 if len(body_list) == len(vsw_list):
-    # initialize the bodies
-    c = SolarMACH(date, body_list, vsw_list, reference_long, reference_lat, coord_sys)
+    # initialize the bodies (cached, so changing only plot options doesn't recompute the positions)
+    timing.count_cache('constellation')
+    c = get_constellation(state)
 
     # make the longitudinal constellation plot
     filename = 'Solar-MACH_'+datetime.datetime.combine(st.session_state.date_input, st.session_state.time_input).strftime("%Y-%m-%d_%H-%M")
 
-    if st.session_state.def_markers.lower()=='squares':
-        markers=False
-    else:
-        markers=st.session_state.def_markers.lower()
-
-    c.plot(
-        plot_spirals=st.session_state.def_plot_spirals,                            # plot Parker spirals for each body
-        plot_sun_body_line=st.session_state.def_plot_sun_body_line,                # plot straight line between Sun and body
-        reference_vsw=st.session_state.def_reference_vsw,                          # define solar wind speed at reference
-        transparent=st.session_state.def_transparent,
-        # numbered_markers=st.session_state.def_numbered,
-        markers=markers,
-        long_offset=st.session_state.def_long_offset,
-        # outfile=filename+'.png'                               # output file (optional)
-    )
-
-    # download plot
-    plot2 = io.BytesIO()
-    plt.savefig(plot2, format='png', bbox_inches="tight")
-    st.download_button(
-        label="Download figure as .png file",
-        data=plot2.getvalue(),
-        file_name=filename+'.png',
-        on_click='ignore',
-        mime="image/png")
+    plot_kwargs = state.plot_kwargs()
+
+    # render figure only once for display and download; cached for the full state
+    plot2 = render_figure(state.key, 'png', c, plot_kwargs)
+    st.image(plot2)
+    timing.mark_startup('first_plot')
+
+    # download plot; other formats than png are only rendered when a button is clicked
+    for fmt, col in zip(FIGURE_FORMATS, st.columns(len(FIGURE_FORMATS))):
+        suffix, mime, _ = FIGURE_FORMATS[fmt]
+        col.download_button(
+            label="Download thumbnail as .png file" if fmt == 'thumbnail' else f"Download figure as .{fmt} file",
+            data=plot2 if fmt == 'png' else functools.partial(render_figure, state.key, fmt, c, plot_kwargs),
+            file_name=filename+suffix,
+            on_click='ignore',
+            mime=mime)
 
     # download plot, alternative. produces actual png image on server.
     # needs # outfile=filename+'.png' uncommented above
@@ -408,45 +453,143 @@ if len(body_list) == len(vsw_list):
            ''')
 
     # display coordinates table
-    df = c.coord_table
-    df.index = df['Spacecraft/Body']
-    df = df.drop(columns=['Spacecraft/Body'])
-    df = df.rename(columns={"Spacecraft/Body": "Spacecraft / body",
-                            f"{coord_sys} longitude (°)": f"{coord_sys} longitude [°]",
-                            f"{coord_sys} latitude (°)": f"{coord_sys} latitude [°]",
-                            "Heliocentric distance (AU)": "Heliocent. distance [AU]",
-                            "Longitudinal separation to Earth's longitude": "Longitud. separation to Earth longitude [°]",
-                            "Latitudinal separation to Earth's latitude": "Latitud. separation to Earth latitude [°]",
-                            "Vsw": "Solar wind speed [km/s]",
-                            f"Magnetic footpoint longitude ({coord_sys})": f"Magnetic footpoint {coord_sys} longitude [°]",
-                            "Longitudinal separation between body and reference_long": "Longitud. separation bw. body & reference [°]",
-                            "Longitudinal separation between body's magnetic footpoint and reference_long": "Longitud. separation bw. body's magnetic footpoint & reference [°]",
-                            "Latitudinal separation between body and reference_lat": "Latitudinal separation bw. body & reference [°]"})
-
-    df2 = df.copy()
-    decimals = 1
-    df = df.round({f"{coord_sys} longitude [°]": decimals,
-                   f"{coord_sys} latitude [°]": decimals,
-                   "Longitud. separation to Earth longitude [°]": decimals,
-                   "Latitud. separation to Earth latitude [°]": decimals,
-                   "Solar wind speed [km/s]": decimals,
-                   f"Magnetic footpoint {coord_sys} longitude [°]": decimals,
-                   "Longitud. separation bw. body & reference [°]": decimals,
-                   "Longitud. separation bw. body's magnetic footpoint & reference [°]": decimals,
-                   "Latitudinal separation bw. body & reference [°]": decimals
-                   }).astype(str)
-    #               }).astype(np.int64).astype(str)  # yes, convert to int64 first and then to str to get rid of ".0" if using decimals=0
-    df["Heliocent. distance [AU]"] = df2["Heliocent. distance [AU]"].round(2).astype(str)
+    with timing.stage('table formatting'):
+        df = format_table(c.coord_table, coord_sys)
 
     st.table(df.T)
 
-    # download coordinates
-    st.download_button(
-        label="Download table as .csv file",
-        data=c.coord_table.to_csv(index=False),
-        file_name=filename+'.csv',
-        on_click='ignore',
-        mime='text/csv')
+    # download coordinates; files are only created when a button is clicked
+    for fmt, col in zip(EXPORT_FORMATS, st.columns(len(EXPORT_FORMATS))):
+        col.download_button(
+            label=f"Download table as .{fmt} file",
+            data=functools.partial(export_table, state.constellation_key, fmt, c),
+            file_name=f'{filename}.{fmt}',
+            on_click='ignore',
+            mime=EXPORT_FORMATS[fmt])
+
+    # footpoints for a range of solar wind speeds, e.g. to estimate their uncertainty
+    with st.expander("Magnetic footpoints for a range of solar wind speeds", expanded=False):
+        sw_col1, sw_col2, sw_col3 = st.columns(3)
+        sweep_min = sw_col1.number_input('Minimum speed (km/s)', min_value=50, max_value=3000, value=250, step=10, key='sweep_min')
+        sweep_max = sw_col2.number_input('Maximum speed (km/s)', min_value=50, max_value=3000, value=800, step=10, key='sweep_max')
+        sweep_step = sw_col3.number_input('Step (km/s)', min_value=1, max_value=1000, value=10, step=5, key='sweep_step')
+        if sweep_max < sweep_min:
+            st.warning('The maximum speed has to be larger than the minimum speed.')
+        else:
+            sweep = footpoint_sweep(c, list(range(sweep_min, sweep_max + 1, sweep_step)))
+            # footpoint longitude vs. speed, i.e. the band covered by each body's footpoint
+            st.line_chart(sweep.T, x_label='Solar wind speed [km/s]', y_label=f'Magnetic footpoint {coord_sys} longitude [°]')
+            # footpoints move to smaller longitudes with increasing speed
+            sweep_spread = pd.DataFrame({f'Footpoint longitude at {sweep.columns[0]} km/s [°]': sweep.iloc[:, 0],
+                                         f'Footpoint longitude at {sweep.columns[-1]} km/s [°]': sweep.iloc[:, -1],
+                                         'Spread [°]': (sweep.iloc[:, 0] - sweep.iloc[:, -1]) % 360}).round(1)
+            st.table(sweep_spread)
+            st.download_button(
+                label="Download footpoints as .csv file",
+                data=functools.partial(sweep.round(3).to_csv),
+                file_name=filename+'_footpoints.csv',
+                on_click='ignore',
+                mime='text/csv')
+
+    # search for the times at which the bodies are magnetically connected to the reference
+    with st.expander("Search for magnetic connection to the reference (BETA)", expanded=False):
+        if reference_long is None:
+            st.info('Activate "Plot reference" in the sidebar to define the reference longitude.')
+        else:
+            st.caption(f'Time windows in which the magnetic footpoint of a body is within the given separation of the reference longitude ({reference_long}°), using the solar wind speeds from above.')
+            cs_col1, cs_col2, cs_col3, cs_col4 = st.columns(4)
+            cs_start = cs_col1.date_input('Start date', value=st.session_state.date_input, key='cs_start')
+            cs_end = cs_col2.date_input('End date', value=st.session_state.date_input+datetime.timedelta(days=90), min_value=cs_start, key='cs_end')
+            cs_max_sep = cs_col3.number_input('Max. separation [°]', min_value=0.5, max_value=180.0, value=10.0, step=1.0, key='cs_max_sep')
+            cs_step = cs_col4.number_input('Coarse step (hours)', min_value=1.0, max_value=48.0, value=6.0, step=1.0, key='cs_step')
+            if st.button('Search connection windows', type='primary'):
+                cs_params = dict(start=f'{cs_start} 00:00:00', end=f'{cs_end} 00:00:00', body_list=tuple(body_list), vsw_list=tuple(vsw_list),
+                                 reference_long=reference_long, max_sep=cs_max_sep, coord_sys=coord_sys, coarse_step=cs_step)
+                try:
+                    with st.spinner('Searching connection windows...'):
+                        st.session_state["connectivity"] = {"params": cs_params, "windows": find_connection_windows(**cs_params)}
+                except (ValueError, RuntimeError) as e:
+                    delete_from_state(["connectivity"])
+                    st.error(f'ERROR: {e}')
+            if "connectivity" in st.session_state:
+                cs_params = st.session_state["connectivity"]["params"]
+                st.write(f"Connection windows from {cs_params['start'][:10]} to {cs_params['end'][:10]} within {cs_params['max_sep']}° of {cs_params['coord_sys']} longitude {cs_params['reference_long']}°:")
+                st.dataframe(st.session_state["connectivity"]["windows"], hide_index=True)
+
+    # time series of the constellation, starting at the selected date & time
+    with st.expander("Time series / movie of the constellation (BETA)", expanded=False):
+        st.caption('Constellation from the selected date and time until the end date and time defined here, using all settings from above.')
+        ts_col1, ts_col2, ts_col3 = st.columns(3)
+        ts_end_date = ts_col1.date_input('End date', value=st.session_state.date_input+datetime.timedelta(days=14), min_value=st.session_state.date_input, key='ts_end_date')
+        ts_end_time = ts_col2.time_input('End time', value=st.session_state.time_input, key='ts_end_time')
+        ts_step = ts_col3.number_input('Step (hours)', min_value=0.25, value=6.0, step=1.0, key='ts_step')
+        ts_formats = ['gif', 'csv']
+        if ffmpeg_available():
+            ts_formats.append('mp4')
+        ts_formats = st.multiselect('Output files', ts_formats, ['gif', 'csv'], key='ts_formats')
+
+        if st.button('Compute time series', type='primary'):
+            ts_end = datetime.datetime.combine(ts_end_date, ts_end_time).strftime("%Y-%m-%d %H:%M:%S")
+            if "timeseries" in st.session_state:
+                shutil.rmtree(st.session_state["timeseries"]["dir"], ignore_errors=True)
+                delete_from_state(["timeseries"])
+            ts_dir = output_dir()
+            ts_progress = st.progress(0.0, text='Computing time series...')
+            ts_nsteps = len(time_steps(date, ts_end, ts_step))
+            try:
+                ts_paths = write_timeseries(ts_dir, filename+'_timeseries', date, ts_end, ts_step, body_list, vsw_list,
+                                            reference_long, reference_lat, coord_sys, plot_kwargs, ts_formats,
+                                            progress=lambda n: ts_progress.progress(min(n/ts_nsteps, 1.0), text='Computing time series...'))
+                st.session_state["timeseries"] = {"dir": ts_dir, "paths": ts_paths}
+            except (ValueError, RuntimeError, OSError) as e:
+                shutil.rmtree(ts_dir, ignore_errors=True)
+                st.error(f'ERROR: {e}')
+            ts_progress.empty()
+
+        if "timeseries" in st.session_state:
+            ts_mime = {'gif': 'image/gif', 'mp4': 'video/mp4', 'csv': 'text/csv'}
+            for fmt, path in st.session_state["timeseries"]["paths"].items():
+                if os.path.exists(path):
+                    st.download_button(
+                        label=f"Download time series as .{fmt} file",
+                        data=functools.partial(read_file, path),
+                        file_name=os.path.basename(path),
+                        on_click='ignore',
+                        mime=ts_mime[fmt])
+
+    # constellations of several events side by side, with all settings from above
+    with st.expander("Compare several events (BETA)", expanded=False):
+        st.caption(f'One panel per event (up to {MAX_EVENTS}), using the bodies and plot options from above. Solar wind speeds measured at an event are used if they have been obtained before, otherwise the ones from above.')
+        grid_col1, grid_col2 = st.columns((3, 1))
+        grid_text = grid_col1.text_area('Events (one date and time per line)', value=f"{date[:16]}\n", key='grid_events')
+        grid_ncols = grid_col2.number_input('Columns', min_value=1, max_value=4, value=3, step=1, key='grid_ncols')
+        if st.button('Compare events', type='primary'):
+            try:
+                grid_states = event_states(state, parse_events(grid_text))
+                if len(grid_states) == 0:
+                    raise ValueError('Please provide at least one event.')
+                with st.spinner('Obtaining constellations of all events...'):
+                    grid_png, grid_table = compare_events(state, grid_states, min(int(grid_ncols), len(grid_states)))
+                st.session_state["grid"] = {"png": grid_png, "table": grid_table}
+            except (ValueError, RuntimeError) as e:
+                delete_from_state(["grid"])
+                st.error(f'ERROR: {e}')
+        if "grid" in st.session_state:
+            st.image(st.session_state["grid"]["png"])
+            st.dataframe(st.session_state["grid"]["table"].round(2), hide_index=True)
+            grid_col1, grid_col2 = st.columns(2)
+            grid_col1.download_button(
+                label="Download comparison as .png file",
+                data=st.session_state["grid"]["png"],
+                file_name=filename+'_comparison.png',
+                on_click='ignore',
+                mime='image/png')
+            grid_col2.download_button(
+                label="Download combined table as .csv file",
+                data=functools.partial(st.session_state["grid"]["table"].to_csv, index=False),
+                file_name=filename+'_comparison.csv',
+                on_click='ignore',
+                mime='text/csv')
 else:
     st.error(f"ERROR: Number of elements in the bodies/spacecraft list \
                ({len(body_list)}) and solar wind speed list ({len(vsw_list)}) \
@@ -475,16 +618,14 @@ with st.expander("⚠️ **The URL format has changed in July 2022 and again in
 
 cont1 = st.container()
 
-def get_short_url(url):
+def get_short_url(state):
     """
-    generate short da.gd URL
+    generate short URL from local permalink store
     """
-    s = pyshorteners.Shortener()
-    surl = s.dagd.short(url)
-    # cont1.write(surl)
+    surl = APP_URL + 's=' + save_permalink(state.to_params())
     cont1.success(surl)
 
-cont1.button('Generate short URL', on_click=get_short_url, args=[url])
+cont1.button('Generate short URL', on_click=get_short_url, args=[state])
 
 # streamlit_analytics.start_tracking()  # TODO: un-comment when streamlit-analytics has been updated with https://github.com/jrieke/streamlit-analytics/pull/44
 
@@ -530,6 +671,13 @@ if "verbose" in st.session_state.keys():
         st.markdown("""---""")
         st.markdown('## Debug Info')
         st.write(st.session_state)
+        st.write('Startup timing of this server process (s):', timing.STARTUP)
+        # timings of the run so far, i.e. without the remainder of the page
+        summary = run.summary()
+        st.write(f"Timing of this run until here: {summary['total']:.3f} s, peak memory of server process: {summary['peak_memory_mb']} MB")
+        st.table({'Duration [s]': summary['stages']})
+        st.write('Cache hits/misses of this run:', summary['caches'])
+        st.write('Cache hits/misses of this server process:', {name: timing.cache_hits(stats) for name, stats in timing.CACHE_STATS.items()})
 
         os.environ['SPEASY_CORE_DISABLED_PROVIDERS'] = "sscweb,archive,csa"
         import plotly
@@ -580,6 +728,14 @@ if 'analytics' in query_params.keys():
 else:
     clear_url()
 
+# log startup timing once per server process
+if timing.mark_startup('first_render'):
+    timing.log('startup', **timing.STARTUP)
+# warm up caches for popular configurations, once the first page is complete
+# (already at server start if started with api.py)
+start_warmup()
+timing.finish_run()
+
 # # goatcounter
 # import streamlit.components.v1 as components
 # html_string = """
@@ -0,0 +1,238 @@
+import concurrent.futures
+import datetime
+import os
+import threading
+import time
+
+import solarmach
+
+import snapshot
+import timing
+from cache_store import SQLiteCache
+
+# maximum number of simultaneous solar wind speed lookups (speasy/AMDA/CDAWeb)
+# per session, and of all sessions together
+MAX_WORKERS = int(os.environ.get('SOLARMACH_MAX_FETCHES', 6))
+MAX_TOTAL_WORKERS = int(os.environ.get('SOLARMACH_MAX_TOTAL_FETCHES', 24))
+_lookup_slots = threading.BoundedSemaphore(MAX_TOTAL_WORKERS)
+# seconds after submission after which the lookup for a single body is given up
+TIMEOUT = 60
+
+# measured speeds are cached per body and datetime rounded to ROUND_MINUTES;
+# "no measurement found" is cached shorter, as data might become available
+ROUND_MINUTES = 15
+FOUND_TTL = 30 * 24 * 60 * 60
+NOT_FOUND_TTL = 6 * 60 * 60
+VSW_CACHE = SQLiteCache('sw_speed.sqlite', max_entries=20000)
+
+
+def cache_key(body, date):
+    """
+    build cache key from standardized body name and rounded datetime
+    """
+    try:
+        body = solarmach.body_dict[body][1]
+    except KeyError:
+        pass
+    dtime = datetime.datetime.fromisoformat(str(date))
+    step = datetime.timedelta(minutes=ROUND_MINUTES)
+    dtime = datetime.datetime.min + round((dtime - datetime.datetime.min) / step) * step
+    return f"{body}|{dtime.strftime('%Y-%m-%dT%H:%M')}"
+
+
+def cached_sw_speed(body, date, cache=VSW_CACHE):
+    """
+    Earlier lookup result of body at date from the snapshot store (if it
+    covers date) or cache (if not None): {'vsw': speed}, {'vsw': None} if no
+    measurement has been found, or None if it hasn't been looked up yet.
+    """
+    vsw = snapshot.get_sw_speed_snapshot(body, date)
+    if vsw is not None:
+        return {'vsw': None if vsw != vsw else vsw}
+    if cache is not None:
+        return cache.get(cache_key(body, date))
+    return None
+
+
+def session_slots():
+    """
+    slots for the lookups of one session: a lookup keeps its slot until it
+    has actually finished, also if it has been given up or cancelled, so that
+    a session never has more than MAX_WORKERS lookups running
+    """
+    return threading.BoundedSemaphore(MAX_WORKERS)
+
+
+def _acquire(slots, deadline, cancel):
+    # wait for a slot until deadline (time.monotonic()), unless cancel is set
+    while cancel is None or not cancel.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if slots.acquire(timeout=min(remaining, 0.5)):
+            return True
+    return False
+
+
+class _Lookup():
+    # a single lookup, which holds a slot of all sessions until it has
+    # finished or has been given up
+
+    def __init__(self, body, default_vsw, deadline):
+        self.body = body
+        self.default_vsw = default_vsw
+        self.submitted = time.monotonic()
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        self._holds_slot = False
+        self._given_up = False
+
+    def run(self, date, slots, cancel):
+        if not _acquire(slots, self.deadline, cancel):
+            raise TimeoutError(f'no free slot for {self.body}')
+        try:
+            if not _acquire(_lookup_slots, self.deadline, cancel):
+                raise TimeoutError(f'no free slot for {self.body}')
+            with self._lock:
+                if self._given_up:
+                    _lookup_slots.release()
+                    raise TimeoutError(f'lookup for {self.body} has been given up')
+                self._holds_slot = True
+            try:
+                return solarmach.get_sw_speed(self.body, date, default_vsw=self.default_vsw)
+            finally:
+                self.release()
+        finally:
+            slots.release()
+
+    def release(self):
+        """
+        hand back the slot of all sessions; called when the lookup has
+        finished, or has been given up (as its thread can't be stopped)
+        """
+        with self._lock:
+            self._given_up = True
+            if self._holds_slot:
+                self._holds_slot = False
+                _lookup_slots.release()
+
+
+def iter_sw_speeds(body_list, date, default_vsw, max_workers=MAX_WORKERS, timeout=TIMEOUT, cache=VSW_CACHE, cancel=None, slots=None):
+    """
+    Obtain measured solar wind speeds for all bodies in a bounded worker pool.
+
+    Yields (body, vsw, found) in the order in which the lookups finish, with
+    results from the snapshot store or cache (if not None) coming first. If no
+    measurement is found, the lookup fails, or it hasn't finished timeout
+    seconds after it was submitted (including the time waiting for a slot),
+    vsw is the corresponding entry of default_vsw and found is False. Only
+    actual lookup results are cached, not failures or timeouts. Stops early
+    (without yielding the remaining bodies) when the threading.Event cancel
+    is set.
+
+    slots (see session_slots()) limits the running lookups of a session over
+    several calls; by default, only those of this call are limited.
+    """
+    if slots is None:
+        slots = session_slots()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='get_sw_speed')
+    futures = {}
+    cached = {}
+    deadline = time.monotonic() + timeout
+    for i, body in enumerate(body_list):
+        cached[body] = cached_sw_speed(body, date, cache)
+        if cached[body] is not None:
+            continue
+        lookup = _Lookup(body, default_vsw[i], deadline)
+        futures[executor.submit(lookup.run, date, slots, cancel)] = lookup
+    pending = set(futures)
+    try:
+        for i, body in enumerate(body_list):
+            if cached.get(body) is None:
+                continue
+            if cached[body]['vsw'] is None:
+                yield body, default_vsw[i], False
+            else:
+                yield body, cached[body]['vsw'], True
+        while pending and not (cancel is not None and cancel.is_set()):
+            done, pending = concurrent.futures.wait(pending, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                lookup = futures[future]
+                body, default = lookup.body, lookup.default_vsw
+                timing.record(f'sw_speed {body}', time.monotonic() - lookup.submitted)
+                try:
+                    vsw = future.result()
+                except Exception:
+                    yield body, default, False
+                    continue
+                found = vsw != default
+                if cache is not None:
+                    if found:
+                        cache.set(cache_key(body, date), {'vsw': float(vsw)}, FOUND_TTL)
+                    else:
+                        cache.set(cache_key(body, date), {'vsw': None}, NOT_FOUND_TTL)
+                yield body, vsw, found
+            # give up on bodies whose lookup is taking too long. the thread
+            # itself can't be stopped, but its result will be ignored
+            now = time.monotonic()
+            for future in list(pending):
+                lookup = futures[future]
+                if now > lookup.deadline:
+                    pending.discard(future)
+                    lookup.release()
+                    timing.record(f'sw_speed {lookup.body}', now - lookup.submitted)
+                    yield lookup.body, lookup.default_vsw, False
+    finally:
+        # lookups that are given up or cancelled don't block other sessions
+        for lookup in futures.values():
+            lookup.release()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SpeedFetch():
+    """
+    Obtain measured solar wind speeds with iter_sw_speeds in a background
+    thread, so that the app stays responsive. The results arrived so far can
+    be read while the lookups are running, and the fetch can be cancelled.
+    slots (see session_slots()) are shared by all fetches of a session.
+    """
+
+    def __init__(self, body_list, date, default_vsw, slots=None):
+        self.body_list = list(body_list)
+        self.date = date
+        self.default_vsw = list(default_vsw)
+        # timings of the lookups, handed over to the next script run
+        self.timings = None
+        self._results = {}
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._slots = slots
+        self._thread = threading.Thread(target=self._run, name='sw_speed_fetch', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        self.timings = timing.start_run()
+        for body, vsw, found in iter_sw_speeds(self.body_list, self.date, self.default_vsw, cancel=self._cancel, slots=self._slots):
+            with self._lock:
+                self._results[body] = (vsw, found)
+
+    def results(self):
+        """
+        dict of body: (vsw, found) of all lookups finished so far
+        """
+        with self._lock:
+            return dict(self._results)
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        """
+        True if all lookups have finished, or the fetch has been cancelled
+        """
+        return self.cancelled or not self._thread.is_alive()
@@ -0,0 +1,209 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+from astropy.time import Time, TimeDelta
+from matplotlib import rcParams
+from matplotlib.animation import FFMpegWriter
+from PIL import GifImagePlugin, Image
+
+from constellation import plot_figure
+from ephemeris import coord_table, get_all_positions, make_constellation
+
+# number of time steps for which positions are obtained and processed at once;
+# together with writing frames one by one this keeps memory usage bounded
+CHUNK_SIZE = 200
+# maximum number of time steps that can be requested
+MAX_STEPS = 5000
+# resolution of movie frames (figure size is 12x8 inches)
+FRAME_DPI = 60
+
+# output files of all sessions are written into subdirectories of OUTPUT_DIR,
+# which are deleted after OUTPUT_MAX_AGE hours, or (oldest first) when all of
+# them together take more than OUTPUT_MAX_MB
+OUTPUT_DIR = os.environ.get('SOLARMACH_TIMESERIES_DIR', os.path.join(tempfile.gettempdir(), 'solarmach_timeseries'))
+OUTPUT_MAX_AGE = float(os.environ.get('SOLARMACH_TIMESERIES_MAX_AGE', 6))
+OUTPUT_MAX_MB = float(os.environ.get('SOLARMACH_TIMESERIES_MAX_MB', 2000))
+_output_lock = threading.Lock()
+
+
+def time_steps(start, end, step):
+    """
+    astropy Time array from start to end (inclusive) with step (in hours)
+    """
+    start = Time(start)
+    n = int(np.floor(((Time(end) - start).to_value('hr') + 1e-9) / step)) + 1
+    return start + TimeDelta(np.arange(max(n, 1)) * step * 3600, format='sec')
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def cleanup_outputs(max_age=OUTPUT_MAX_AGE, max_mb=OUTPUT_MAX_MB):
+    """
+    delete output directories in OUTPUT_DIR older than max_age hours, and the
+    oldest ones as long as all together are larger than max_mb
+    """
+    try:
+        dirs = [os.path.join(OUTPUT_DIR, name) for name in os.listdir(OUTPUT_DIR)]
+    except FileNotFoundError:
+        return
+    dirs = sorted((os.path.getmtime(path), path) for path in dirs if os.path.isdir(path))
+    sizes = {path: _dir_size(path) for _, path in dirs}
+    total = sum(sizes.values())
+    now = time.time()
+    for mtime, path in dirs:
+        if now - mtime < max_age * 3600 and total <= max_mb * 1024**2:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= sizes[path]
+
+
+def output_dir():
+    """
+    new directory for the output files of one time series, after removing
+    old ones (see cleanup_outputs)
+    """
+    with _output_lock:
+        cleanup_outputs()
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        return tempfile.mkdtemp(prefix='solarmach_', dir=OUTPUT_DIR)
+
+
+def ffmpeg_available():
+    return FFMpegWriter.isAvailable()
+
+
+class _GifWriter():
+    """
+    Write an animated gif frame by frame, without keeping previous frames
+    in memory (as PIL's save_all does)
+    """
+
+    def __init__(self, path, duration):
+        self.fp = open(path, 'wb')
+        self.duration = duration
+        self.size = None
+
+    def append(self, image):
+        frame = image.convert('RGB').convert('P', palette=Image.Palette.ADAPTIVE)
+        if self.size is None:
+            self.size = frame.size
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': 0, 'duration': self.duration})
+            self.fp.write(b''.join(header))
+        for data in GifImagePlugin.getdata(frame, duration=self.duration, include_color_table=True):
+            self.fp.write(data)
+
+    def close(self):
+        self.fp.write(b';')
+        self.fp.close()
+
+
+class _Mp4Writer():
+    """
+    Pipe raw frames into ffmpeg to write an mp4 video
+    """
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.proc = None
+
+    def append(self, image):
+        if self.proc is None:
+            self.proc = subprocess.Popen([rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+                                          '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '{}x{}'.format(*image.size),
+                                          '-r', str(self.fps), '-i', '-',
+                                          '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', self.path],
+                                         stdin=subprocess.PIPE)
+        self.proc.stdin.write(image.convert('RGB').tobytes())
+
+    def close(self):
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc.wait()
+
+
+def _render_frame(c, plot_kwargs, dpi=FRAME_DPI):
+    # no bbox_inches="tight" here, so that all frames have the same size
+    fig = plot_figure(c, plot_kwargs)
+    image = io.BytesIO()
+    fig.savefig(image, format='png', dpi=dpi)
+    image.seek(0)
+    return Image.open(image)
+
+
+def write_timeseries(outdir, basename, start, end, step, body_list, vsw_list, reference_long=None, reference_lat=None,
+                     coord_sys='Carrington', plot_kwargs={}, formats=('gif', 'csv'), fps=4, progress=None):
+    """
+    Obtain the constellation from start to end every step hours and write the
+    coordinate tables of all times into one csv file and/or the plots into an
+    animated gif or mp4 file. Positions are obtained for CHUNK_SIZE times at
+    once, and frames are written one by one.
+
+    Parameters
+    ----------
+    outdir, basename: str
+        output files are outdir/basename.csv, .gif, .mp4
+    plot_kwargs: dict
+        options passed to SolarMACH.plot()
+    formats: list
+        any of 'csv', 'gif', 'mp4'
+    progress: callable, optional
+        called with the number of finished time steps after each step
+
+    Returns
+    -------
+    dict
+        format -> path of written file
+    """
+    times = time_steps(start, end, step)
+    if len(times) > MAX_STEPS:
+        raise ValueError(f'Too many time steps ({len(times)}), the maximum is {MAX_STEPS}.')
+    vsw_dict = dict(zip(body_list, vsw_list))
+    # the background of movies can't be transparent
+    plot_kwargs = dict(plot_kwargs, transparent=False)
+
+    paths = {fmt: os.path.join(outdir, f'{basename}.{fmt}') for fmt in formats}
+    writers = []
+    if 'gif' in paths:
+        writers.append(_GifWriter(paths['gif'], duration=int(1000 / fps)))
+    if 'mp4' in paths:
+        writers.append(_Mp4Writer(paths['mp4'], fps))
+    csv_started = False
+    try:
+        for i in range(0, len(times), CHUNK_SIZE):
+            chunk = times[i:i+CHUNK_SIZE]
+            pos_E, positions = get_all_positions(body_list, chunk, coord_sys)
+            if len(positions) == 0:
+                continue
+            if 'csv' in paths:
+                table = coord_table(chunk, pos_E, positions, vsw_dict, reference_long, reference_lat, coord_sys)
+                table.to_csv(paths['csv'], mode='a' if csv_started else 'w', header=not csv_started, index=False)
+                csv_started = True
+            for j in range(len(chunk)):
+                if writers:
+                    c = make_constellation(chunk[j], pos_E[j], {body: pos[j] for body, pos in positions.items()},
+                                           vsw_dict, reference_long, reference_lat, coord_sys)
+                    frame = _render_frame(c, plot_kwargs)
+                    for writer in writers:
+                        writer.append(frame)
+                if progress is not None:
+                    progress(i + j + 1)
+    finally:
+        for writer in writers:
+            writer.close()
+    return paths
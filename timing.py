@@ -0,0 +1,187 @@
+"""
+Startup and per-run timing of the Solar-MACH app.
+
+This module is imported first by streamlit_app.py, so the time of its import
+marks the start of the first script run of the server process. The durations
+until the imports are done, the figure is shown, and the page is complete
+are logged once per process as a JSON line (logger "solarmach_app").
+
+In addition, every script run collects the durations of its stages (e.g.
+obtaining positions, plotting), cache hits and misses, and the peak memory
+usage of the process. They are shown in the debug info of the app (URL
+parameter verbose=1) and logged as one JSON line per run.
+
+Run "python timing.py" to measure the cold import time of the app's heavy
+dependencies, each in a fresh interpreter, e.g. to compare releases.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_IMPORTED = time.perf_counter()
+
+logger = logging.getLogger('solarmach_app')
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(os.environ.get('SOLARMACH_LOG_LEVEL', 'INFO'))
+    logger.propagate = False
+
+# stage -> seconds since start of first script run
+STARTUP = {}
+
+# cache name -> {'lookups': n, 'misses': n}, for all runs of this process
+CACHE_STATS = {}
+_cache_stats_lock = threading.Lock()
+
+# timings of the script run in the current thread
+_current_run = contextvars.ContextVar('solarmach_run', default=None)
+
+# dependencies whose import time is measured by "python timing.py"
+MODULES = ['streamlit', 'matplotlib.pyplot', 'solarmach', 'sunpy.coordinates', 'speasy', 'stqdm', 'plotly']
+
+
+def mark_startup(stage):
+    """
+    record the time at which stage is reached for the first time in this
+    process; returns True if it has not been reached before
+    """
+    if stage in STARTUP:
+        return False
+    STARTUP[stage] = round(time.perf_counter() - _IMPORTED, 3)
+    return True
+
+
+def log(event, **data):
+    """
+    write structured log entry (JSON line)
+    """
+    logger.info(json.dumps({'event': event, **data}))
+
+
+class RunTimings():
+    """
+    Durations of the stages (in s) and cache lookups of one script run
+    """
+
+    def __init__(self, previous=None):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.caches = {}
+        if previous is not None:
+            # e.g. timings of a callback that has been run before the script
+            self.stages.update(previous.stages)
+            for name, stats in previous.caches.items():
+                self.caches[name] = dict(stats)
+
+    def record(self, stage, seconds):
+        self.stages[stage] = round(self.stages.get(stage, 0) + seconds, 4)
+
+    def count_cache(self, name, miss=False):
+        stats = self.caches.setdefault(name, {'lookups': 0, 'misses': 0})
+        stats['misses' if miss else 'lookups'] += 1
+
+    def summary(self):
+        return {'total': round(time.perf_counter() - self.start, 4),
+                'stages': self.stages,
+                'caches': {name: cache_hits(stats) for name, stats in self.caches.items()},
+                'peak_memory_mb': peak_memory_mb()}
+
+
+def start_run(previous=None):
+    """
+    start collecting timings for the script run in the current thread
+    """
+    run = RunTimings(previous)
+    _current_run.set(run)
+    return run
+
+
+def finish_run():
+    """
+    stop collecting timings for the current script run and log them
+    """
+    run = _current_run.get()
+    if run is None:
+        return None
+    _current_run.set(None)
+    summary = run.summary()
+    log('run', **summary)
+    return summary
+
+
+def record(stage, seconds):
+    """
+    add duration of stage to the current script run (if any)
+    """
+    run = _current_run.get()
+    if run is not None:
+        run.record(stage, seconds)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    context manager that records its duration as stage name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def count_cache(name, miss=False):
+    """
+    Count a lookup of cache name, or a miss if miss=True. For caches whose
+    misses can only be detected inside the cached function, call this with
+    miss=True there and without it at the place of the lookup.
+    """
+    with _cache_stats_lock:
+        stats = CACHE_STATS.setdefault(name, {'lookups': 0, 'misses': 0})
+        stats['misses' if miss else 'lookups'] += 1
+    run = _current_run.get()
+    if run is not None:
+        run.count_cache(name, miss)
+
+
+def cache_hits(stats):
+    return {'hits': stats['lookups'] - stats['misses'], 'misses': stats['misses']}
+
+
+def peak_memory_mb():
+    """
+    peak resident memory of this process in MB
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return round(maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024, 1)
+
+
+def import_time(module):
+    """
+    seconds needed to import module in a fresh python interpreter
+    """
+    code = f'import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return round(float(result.stdout.strip().splitlines()[-1]), 3)
+
+
+if __name__ == '__main__':
+    print(json.dumps({module: import_time(module) for module in MODULES}, indent=2))
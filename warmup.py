@@ -0,0 +1,117 @@
+"""
+Warm-up of the app's caches at server start, then every WARMUP_INTERVAL
+hours and shortly after midnight UTC (when the default date changes), so
+that the first visitor of a configuration doesn't have to wait for JPL
+Horizons, the solar wind speed lookups, and plotting.
+
+Warmed up are the default configuration of the app (default bodies at today
+minus two days) and all configurations listed in WARMUP_FILE, one per line as
+full URL, query string (e.g. "date=20240501&bodies=Earth&bodies=PSP"), or ID
+of a short URL.
+"""
+import datetime
+import os
+import threading
+import time
+import urllib.parse
+
+import timing
+from app_state import AppState, parse_params
+from cache_store import CACHE_DIR
+from constellation import get_constellation, render_figure
+from permalinks import resolve_permalink
+from sw_speed import iter_sw_speeds
+
+WARMUP_INTERVAL = float(os.environ.get('SOLARMACH_WARMUP_INTERVAL', 6))
+WARMUP_FILE = os.environ.get('SOLARMACH_WARMUP_FILE', os.path.join(CACHE_DIR, 'warmup.txt'))
+# minutes after midnight UTC at which the warm-up is run for the new default date
+WARMUP_AFTER_MIDNIGHT = 5
+
+# warm-up thread of the process (started once, not affected by clearing caches)
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+
+def warm_up(state):
+    """
+    obtain constellation, solar wind speeds, and png figure of one
+    configuration (AppState)
+    """
+    c = get_constellation(state)
+    render_figure(state.key, 'png', c, state.plot_kwargs())
+    # measured speeds are only put into the (persistent) cache
+    for _ in iter_sw_speeds(list(state.bodies), state.timestamp, list(state.speeds)):
+        pass
+
+
+def configurations(path=WARMUP_FILE):
+    """
+    default configuration and all those listed in file path, as AppState
+    """
+    result = [AppState()]
+    try:
+        with open(path) as f:
+            lines = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    except OSError:
+        lines = []
+    for line in lines:
+        query = urllib.parse.urlsplit(line).query if '?' in line else line
+        params = urllib.parse.parse_qs(query) if '=' in query else {'s': [query]}
+        if 's' in params:
+            # short URL, or its ID
+            permalink = resolve_permalink(params.pop('s')[0])
+            if permalink is None:
+                timing.logger.warning(f'warm-up: unknown short URL in {line}')
+                continue
+            params = {**permalink, **params}
+        result.append(parse_params(params)[0])
+    return result
+
+
+def run_warmup():
+    start = time.perf_counter()
+    failed = 0
+    todo = configurations()
+    for state in todo:
+        try:
+            warm_up(state)
+        except Exception as e:
+            # e.g. JPL Horizons down
+            failed += 1
+            timing.logger.warning(f'warm-up of {state.url()} failed: {e!r}')
+    timing.log('warmup', configurations=len(todo), failed=failed, duration=round(time.perf_counter() - start, 3))
+
+
+def seconds_to_next_run(now=None):
+    """
+    seconds from now (UTC datetime) until the next warm-up: WARMUP_INTERVAL
+    hours later, or WARMUP_AFTER_MIDNIGHT minutes after the next midnight
+    UTC if that's earlier
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    after_midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), now.tzinfo) \
+        + datetime.timedelta(minutes=WARMUP_AFTER_MIDNIGHT)
+    return min(WARMUP_INTERVAL * 3600, (after_midnight - now).total_seconds())
+
+
+def _loop():
+    while True:
+        run_warmup()
+        time.sleep(seconds_to_next_run())
+
+
+def start_warmup():
+    """
+    Start warm-up in a background thread, which repeats it (see
+    seconds_to_next_run); only once per process, and not at all if
+    WARMUP_INTERVAL is 0. Called at server start by api.py, and by the app's
+    script for servers started without it.
+    """
+    global _warmup_thread
+    if WARMUP_INTERVAL <= 0:
+        return None
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_loop, name='warmup', daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread